@@ -9,16 +9,21 @@
 #
 ####################################################################################################
 
-from pymongo import MongoClient
+import os
+import sys
+
+# The shared modules are in the "common" directory at the root of the repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from cps2_config import mongo_client
 
 print("Connecting to MongoDB.")
 
-mongo_client = MongoClient("192.168.43.48", 27017)
+client = mongo_client()
 
 print("Persisting new scenarios in the collection \"scenarios\" of the database "
 	"\"cps2_project\" in MongoDB...")
 
-mongo_client.cps2_project.scenarios.insert_many([
+client.cps2_project.scenarios.insert_many([
 {
 	"scenario_id": 1,
 	"scenario_name": "shutdown",
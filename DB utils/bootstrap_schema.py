@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+#
+# File: bootstrap_schema.py
+#
+# Description: Create the indexes required on the collections of MongoDB (see common/cps2_schema.py) and verify them
+#
+# Dependencies:
+#   - pymongo (sudo pip3 install pymongo)
+#
+####################################################################################################
+
+import os
+import sys
+
+# The shared modules are in the "common" directory at the root of the repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from cps2_config import mongo_client
+from cps2_schema import DATABASE, INDEXES, create_indexes, missing_indexes
+
+print("Connecting to MongoDB.")
+
+database = mongo_client()[DATABASE]
+
+print("Creating the missing indexes of the database \"" + DATABASE + "\" in MongoDB...")
+
+for collection, name, error in create_indexes(database):
+	print("Unable to create the index " + name + " of the collection \"" + collection + "\": " + str(error))
+
+missing = missing_indexes(database)
+for collection, indexes in INDEXES.items():
+	for name, keys, unique in indexes:
+		status = "MISSING" if (collection, name) in missing else "ok"
+		print("  " + collection + "." + name + (" (unique)" if unique else "") + ": " + status)
+
+if missing:
+	print("Some indexes are missing. Remove the duplicates (see empty_objects.py) and run this script again.")
+	sys.exit(1)
+
+print("Done.")
@@ -9,8 +9,14 @@
 #
 ####################################################################################################
 
-from influxdb import InfluxDBClient
+import os
+import sys
 
-dbclient = InfluxDBClient('localhost', 8086, '', '', 'cps2_project')
-print("Drop database: cps2_project")
-dbclient.drop_database("cps2_project")
\ No newline at end of file
+# The shared modules are in the "common" directory at the root of the repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from cps2_config import get_config, influxdb_client
+
+database = get_config("influxdb")["database"]
+dbclient = influxdb_client()
+print("Drop database: " + database)
+dbclient.drop_database(database)
\ No newline at end of file
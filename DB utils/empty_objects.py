@@ -9,15 +9,20 @@
 #
 ####################################################################################################
 
-from pymongo import MongoClient
+import os
+import sys
+
+# The shared modules are in the "common" directory at the root of the repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from cps2_config import mongo_client
 
 print("Connecting to MongoDB.")
 
-mongo_client = MongoClient("192.168.43.48", 27017)
+client = mongo_client()
 
 print("Deleting all the documents of the collection \"objects\" of the database "
 	"\"cps2_project\" in MongoDB...")
 
-mongo_client.cps2_project.objects.delete_many({})
+client.cps2_project.objects.delete_many({})
 
 print("Done.")
\ No newline at end of file
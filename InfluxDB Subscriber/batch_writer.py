@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+#
+# File: batch_writer.py
+#
+# ### Description
+# Write-behind batching stage between the MQTT subscriber and InfluxDB.
+#
+# ### Features
+# The points are accumulated in a bounded in-memory buffer and written by a background thread, either when a batch
+# is full or when the flush interval has elapsed. When InfluxDB is slower than the incoming metrics the buffer fills
+# up and the drop policy decides what happens to the new points:
+# - "block": the caller waits until there is room in the buffer (or the block timeout expires and the point is dropped)
+# - "drop-newest": the new point is dropped
+# - "drop-oldest": the oldest buffered point is dropped to make room for the new one
+#
+# A batch which cannot be written because of a connection error or a server error (5xx) is put back in front of the
+# buffer and retried after a short pause. A batch rejected by InfluxDB (4xx) would be rejected again, so it is not
+# retried: a 400 (e.g. a field type conflict) is split in halves to isolate the bad points and write the other ones,
+# and the rejected points are dropped and counted. All the remaining points are flushed when the writer is closed.
+# Counters about the batch sizes, the flush latency and the dropped points are available with `stats()`.
+#
+# ### Dependencies
+# - influxdb (sudo apt-get install python3-influxdb)
+#
+####################################################################################################
+
+import logging
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class BatchWriter:
+    """ buffer points in memory and write them to InfluxDB in batches """
+
+    DROP_POLICIES = ("block", "drop-newest", "drop-oldest")
+
+    def __init__(self, dbclient, batch_size=500, flush_interval=1.0, max_queue_size=10000,
+                 drop_policy="drop-oldest", block_timeout=1.0, retry_interval=1.0, protocol="json",
+                 time_precision=None):
+        """ initialize the writer and start the flushing thread.
+        time_precision is the precision of the timestamps of the points (n, u, ms or s), None for nanoseconds.
+        """
+        if drop_policy not in self.DROP_POLICIES:
+            raise ValueError("Unknown drop policy: " + drop_policy)
+        if batch_size > max_queue_size:
+            raise ValueError("The batch size cannot be larger than the queue size")
+
+        self.dbclient = dbclient
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue_size = max_queue_size
+        self.drop_policy = drop_policy
+        self.block_timeout = block_timeout
+        self.retry_interval = retry_interval
+        self.protocol = protocol
+        self.time_precision = time_precision
+
+        self.buffer = deque()
+        self.condition = threading.Condition()
+        self.closing = False
+        self.last_flush = time.monotonic()
+
+        # Counters, protected by the condition lock
+        self.counters = {
+            "points_received": 0,
+            "points_written": 0,
+            "points_dropped": 0,
+            "points_rejected": 0,
+            "batches_written": 0,
+            "write_errors": 0,
+            "batch_size_total": 0,
+            "batch_size_max": 0,
+            "flush_latency_total": 0.0,
+            "flush_latency_max": 0.0,
+            "flush_latency_last": 0.0,
+        }
+
+        self.thread = threading.Thread(target=self._run, name="influxdb-batch-writer", daemon=True)
+        self.thread.start()
+
+    def write(self, point):
+        """ add a point to the buffer. Return False if the point (or an older one) was dropped. """
+        with self.condition:
+            self.counters["points_received"] += 1
+            accepted = True
+            if len(self.buffer) >= self.max_queue_size:
+                if self.drop_policy == "block":
+                    self.condition.wait_for(lambda: len(self.buffer) < self.max_queue_size or self.closing,
+                                            self.block_timeout)
+                    if len(self.buffer) >= self.max_queue_size:
+                        self.counters["points_dropped"] += 1
+                        return False
+                elif self.drop_policy == "drop-newest":
+                    self.counters["points_dropped"] += 1
+                    return False
+                else:
+                    self.buffer.popleft()
+                    self.counters["points_dropped"] += 1
+                    accepted = False
+            self.buffer.append(point)
+            # Wake up the flushing thread, which waits without timeout while the buffer is empty
+            if len(self.buffer) == 1 or len(self.buffer) >= self.batch_size:
+                self.condition.notify_all()
+            return accepted
+
+    def close(self, timeout=None):
+        """ flush all the buffered points and stop the flushing thread """
+        with self.condition:
+            self.closing = True
+            self.condition.notify_all()
+        self.thread.join(timeout)
+
+    def stats(self):
+        """ return a snapshot of the counters """
+        with self.condition:
+            stats = dict(self.counters)
+            stats["queue_depth"] = len(self.buffer)
+        batches = stats["batches_written"]
+        # The size of the batches sent, whether their points were written or rejected
+        stats["batch_size_avg"] = stats.pop("batch_size_total") / batches if batches else 0.0
+        stats["flush_latency_avg"] = stats.pop("flush_latency_total") / batches if batches else 0.0
+        return stats
+
+    def _ready(self):
+        """ tell whether a batch should be flushed now. Must be called with the lock held. """
+        if self.closing or len(self.buffer) >= self.batch_size:
+            return True
+        return len(self.buffer) > 0 and time.monotonic() - self.last_flush >= self.flush_interval
+
+    def _run(self):
+        """ flushing thread: wait for a full batch or for the flush interval, then write """
+        while True:
+            with self.condition:
+                while not self._ready():
+                    if self.buffer:
+                        self.condition.wait(max(0.0, self.last_flush + self.flush_interval - time.monotonic()))
+                    else:
+                        # Nothing to flush until a point is written or the writer is closed
+                        self.condition.wait()
+                if self.closing and not self.buffer:
+                    return
+                batch = [self.buffer.popleft() for _ in range(min(self.batch_size, len(self.buffer)))]
+                # Wake up the producers blocked on a full buffer
+                self.condition.notify_all()
+
+            if not self._flush(batch) and not self.closing:
+                time.sleep(self.retry_interval)
+
+    def _write(self, points):
+        """ write points to InfluxDB and return the number of points written. The points rejected by InfluxDB are
+        dropped and counted; the other errors (connection, server) are raised so that the batch is retried.
+        """
+        try:
+            self.dbclient.write_points(points, time_precision=self.time_precision, protocol=self.protocol)
+            return len(points)
+        except Exception as e:
+            code = getattr(e, "code", None)
+            if not isinstance(code, int) or not 400 <= code < 500:
+                raise
+            if code != 400 or len(points) == 1:
+                logger.error("InfluxDB rejected %d points, dropping them: %s", len(points), e)
+                with self.condition:
+                    self.counters["points_rejected"] += len(points)
+                return 0
+        # Isolate the bad points
+        half = len(points) // 2
+        return self._write(points[:half]) + self._write(points[half:])
+
+    def _flush(self, batch):
+        """ write one batch to InfluxDB and update the counters """
+        start = time.monotonic()
+        try:
+            written = self._write(batch)
+        except Exception as e:
+            logger.error("Unable to write %d points to InfluxDB: %s", len(batch), e)
+            with self.condition:
+                self.counters["write_errors"] += 1
+                self.last_flush = time.monotonic()
+                if self.closing:
+                    # Nobody will retry the batch after closing
+                    self.counters["points_dropped"] += len(batch)
+                    return False
+                # Put the batch back in front of the buffer, the oldest points are dropped if there is not enough room
+                room = self.max_queue_size - len(self.buffer)
+                if room < len(batch):
+                    self.counters["points_dropped"] += len(batch) - room
+                    batch = batch[len(batch) - room:] if room > 0 else []
+                self.buffer.extendleft(reversed(batch))
+            return False
+
+        latency = time.monotonic() - start
+        with self.condition:
+            self.last_flush = time.monotonic()
+            self.counters["points_written"] += written
+            self.counters["batches_written"] += 1
+            self.counters["batch_size_total"] += len(batch)
+            self.counters["batch_size_max"] = max(self.counters["batch_size_max"], len(batch))
+            self.counters["flush_latency_total"] += latency
+            self.counters["flush_latency_max"] = max(self.counters["flush_latency_max"], latency)
+            self.counters["flush_latency_last"] = latency
+        return True
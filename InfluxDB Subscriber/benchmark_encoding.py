@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+#
+# File: benchmark_encoding.py
+#
+# ### Description
+# Microbenchmark of the encoding of a metric: point dictionary serialized by the influxdb client versus the direct
+# line protocol encoder with the tag strings cached per topic.
+#
+# ### Usage
+# python3 benchmark_encoding.py [number_of_points]
+#
+# ### Dependencies
+# - paho-mqtt (sudo pip3 install paho-mqtt)
+# - influxdb (sudo apt-get install python3-influxdb)
+#
+####################################################################################################
+
+import sys
+import timeit
+
+from influxdb.line_protocol import make_lines
+
+from influxdb_subscriber import make_json_point
+from line_protocol import LineProtocolEncoder
+from topic_cache import TopicCache
+
+# A small set of stable topics, as in a real deployment (one per object per metric)
+TOPICS = ["EF/" + str(floor) + "/" + str(floor) + ".0" + str(room) + "/systemData Publisher/Computer " + str(room)
+          + "/metrics/" + metric
+          for floor in range(4) for room in range(5) for metric in ("cpu_usage", "memory_usage", "disk_usage")]
+TIMESTAMP = 1516000000000000000
+
+
+def encode_json(count, topic_cache):
+    """ build the point dictionary and let the influxdb client serialize it """
+    for i in range(count):
+        point = make_json_point(topic_cache, TOPICS[i % len(TOPICS)], 42.5, TIMESTAMP)
+        make_lines({"points": [point]})
+
+
+def encode_line(count, encoder):
+    """ encode the point directly with the cached prefix of the topic """
+    for i in range(count):
+        encoder.encode(TOPICS[i % len(TOPICS)], 42.5, TIMESTAMP)
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    topic_cache = TopicCache()
+    encoder = LineProtocolEncoder(topic_cache)
+
+    # Both paths must produce the same line
+    expected = make_lines({"points": [make_json_point(topic_cache, TOPICS[0], 42.5, TIMESTAMP)]}).strip()
+    assert encoder.encode(TOPICS[0], 42.5, TIMESTAMP) == expected, expected
+
+    for name, function in (("dictionary + make_lines", lambda: encode_json(count, topic_cache)),
+                           ("line protocol encoder", lambda: encode_line(count, encoder))):
+        duration = min(timeit.repeat(function, number=1, repeat=3))
+        print("{:<25} {:>10.3f} s for {} points ({:.2f} us/point)".format(
+            name, duration, count, duration / count * 1000000))
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+#
+# File: benchmark_payloads.py
+#
+# ### Description
+# Microbenchmark of the metric payloads: decoding cost and bytes on the wire per point for the text messages (one
+# message per field, parsed with float() and a fallback to text), the batched JSON messages and the binary messages.
+#
+# ### Usage
+# python3 benchmark_payloads.py [number_of_samples]
+#
+# The bytes per point count the topic and the payload of the messages (not the MQTT header, which is the same for
+# each message). The batched formats save bytes and messages, but decoding them is slower than the text messages.
+#
+####################################################################################################
+
+import os
+import sys
+import timeit
+
+from influxdb_subscriber import decode_value
+
+# The shared modules are in the "common" directory at the root of the repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from metrics_codec import BATCH_CHANNEL, BINARY_CHANNEL, decode_binary, decode_fields, encode_binary, encode_fields
+
+BASE_TOPIC = "EF/1/1.32/systemData Publisher/Computer 1"
+# A sample of a system data publisher, with a text field such as the status of a lamp
+SAMPLE = {"cpu_usage": 12.5, "memory_usage": 43.1, "disk_usage": 71.0, "status": "ON"}
+TIMESTAMP = 1516000000000000000
+
+
+def text_messages(sample):
+    """ one message per field, the value as a decimal string """
+    return [(BASE_TOPIC + "/metrics/" + name, str(value).encode("utf-8")) for name, value in sample.items()]
+
+
+def decode_text(messages):
+    for topic, payload in messages:
+        decode_value(payload)
+
+
+def wire_size(messages):
+    """ bytes of the topics and the payloads """
+    return sum(len(topic.encode("utf-8")) + len(payload) for topic, payload in messages)
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    points = len(SAMPLE)
+
+    text = text_messages(SAMPLE)
+    numbers = [message for message in text if not message[0].endswith("/status")]
+    batched = [(BASE_TOPIC + "/" + BATCH_CHANNEL, encode_fields(SAMPLE).encode("utf-8"))]
+    binary = [(BASE_TOPIC + "/" + BINARY_CHANNEL, encode_binary(SAMPLE))]
+    binary_timestamp = [(BASE_TOPIC + "/" + BINARY_CHANNEL, encode_binary(SAMPLE, TIMESTAMP))]
+
+    # All the payloads must give the same values
+    assert decode_fields(batched[0][1]) == (SAMPLE, None)
+    assert decode_binary(binary_timestamp[0][1]) == (SAMPLE, TIMESTAMP)
+    assert {topic.rsplit("/", 1)[1]: decode_value(payload) for topic, payload in text} == SAMPLE
+
+    print("{} samples of {} fields ({} text)".format(count, points, points - len(numbers)))
+    for name, messages, size, function in (
+            ("text, numbers only", numbers, len(numbers), lambda: decode_text(numbers)),
+            ("text", text, points, lambda: decode_text(text)),
+            ("batched JSON", batched, points, lambda: decode_fields(batched[0][1])),
+            ("binary", binary, points, lambda: decode_binary(binary[0][1])),
+            ("binary + timestamp", binary_timestamp, points, lambda: decode_binary(binary_timestamp[0][1]))):
+        duration = min(timeit.repeat(function, number=count, repeat=3))
+        print("{:<20} {:>8.3f} us/point to decode {:>8.1f} bytes/point".format(
+            name, duration / (count * size) * 1000000, wire_size(messages) / size))
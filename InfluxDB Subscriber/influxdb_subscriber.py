@@ -5,88 +5,340 @@
 # ### Description
 # This program is a MQTT subscriber which receives the metrics sent by the objects on the topic:
 # <building>/<floor>/<room>/<object_type>/<object_name>/metrics/<metrics_name> and the message is the value.
+# The objects may also publish all the fields of a sample at once on
+# <building>/<floor>/<room>/<object_type>/<object_name>/batch/metrics (see common/metrics_codec.py): such a message is
+# written as a single point with one field per metric name. The same sample can be sent in a compact binary payload on
+# .../batch/metrics.bin; the values carry a type tag.
+#
+# The points are timestamped with integer nanoseconds since the epoch: the timestamp of the sample when the object
+# includes it in a batched or binary payload, the receive time otherwise. Since the time of a point does not depend on
+# when it is processed, the queueing in the pipeline and the batching do not distort the series. The timestamps are
+# written with the precision given by --precision (default: n for nanoseconds).
 #
 # ### Features
 # The topic structure allows to retrieve some metadata about the metrics. All of them are stored as tags associated with the metrics in 
-# InfluxDB. The database used is always "cps2_project" and the measurement (equivalent for table in SQL) is the object type. Thus, all the 
+# InfluxDB. The database used is "cps2_project" by default and the measurement (equivalent for table in SQL) is the object type. Thus, all the 
 # objects of a same type have their metrics in one measurement (=table) and can be easily queried.
 #
 # The metrics can be visualized in the Chronograf dashboard. You can also make queries, export the data in csv, create e-mail alerts using 
 # Kapacitor, and more. See the documentation [here](https://docs.influxdata.com/chronograf/v1.4/introduction/getting-started/).
 #
+# The points are not written one by one: they go through a write-behind batching stage (see batch_writer.py) which
+# flushes them when a batch is full or when the flush interval has elapsed. The thresholds, the buffer size and the
+# drop policy can be set on the command line (run with --help). The batching counters are logged periodically.
+#
+# The paho callback does not process the messages itself: it hands them off to an ingest pipeline (see
+# ingest_pipeline.py) so that a stall of InfluxDB never blocks the MQTT loop. The pipeline mode (inline, threads or
+# asyncio) and the number of workers are chosen at startup; the queue depth and the latency of each stage are
+# reported with the batching counters.
+#
+# Nothing is printed synchronously for each metric: the logs go through the queued logging of common/cps2_logging.py,
+# the received metrics are logged at the DEBUG level and sampled (1 out of --log-sample), and the throughput is
+# summarized with the other counters.
+#
+# By default the points are encoded directly in line protocol (see line_protocol.py) with the tag strings cached per
+# topic, instead of building a dictionary that the influxdb client serializes again. The dictionary path is still
+# available with --encoding json. In both cases the topics are parsed once and their metadata is kept in an
+# LRU-bounded cache (see topic_cache.py) whose hit / miss counters are reported with the other counters.
+#
+# The addresses of InfluxDB and of the broker, and the settings of the clients (pool size, timeout, retries, keep-alive,
+# in-flight window, ...) are read from the environment or a JSON file (see common/cps2_config.py). The subscriber runs
+# next to the broker: unless the host of the broker is set (e.g. CPS2_MQTT_HOST), it connects to localhost.
+#
 # ### Dependencies
 # - paho-mqtt (sudo pip3 install paho-mqtt)
-# - influxdb (sudo apt-get install python3-influxdb)
+# - influxdb 5.0.0 or later (sudo pip3 install "influxdb>=5.0.0")
 #
 ####################################################################################################
 
-import paho.mqtt.client as mqtt
-import datetime
+import argparse
+import functools
+import json
+import logging
+import math
+import os
+import signal
+import sys
+import threading
 import time
 
-from influxdb import InfluxDBClient
+from batch_writer import BatchWriter
+from ingest_pipeline import PIPELINES, create_pipeline
+from line_protocol import LineProtocolEncoder, is_number
+from topic_cache import TopicCache
+
+# The shared modules are in the "common" directory at the root of the repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from cps2_config import get_config, influxdb_client, mqtt_client, mqtt_connect
+from cps2_logging import SampledLogger, ThroughputReporter, setup_logging
+from metrics_codec import BATCH_CHANNEL, BINARY_CHANNEL, decode_binary, decode_fields, storable_fields
+
+logger = logging.getLogger("influxdb_subscriber")
+# The lines logged for every metric are sampled, the throughput is summarized periodically
+message_log = SampledLogger(logger)
+throughput = ThroughputReporter(logger, "metrics")
+# values of the batched messages which are not stored (see storable_fields in common/metrics_codec.py)
+skipped = ThroughputReporter(logger, "skipped batched values")
+
+
+# One field per message, and the batched fields of a sample
+METRIC_TOPICS = ("+/+/+/+/+/metrics/+", "+/+/+/+/+/" + BATCH_CHANNEL, "+/+/+/+/+/" + BINARY_CHANNEL)
+
+# broker used when its host is not set in the settings
+DEFAULT_BROKER = "localhost"
+
+# divisor of the timestamps in nanoseconds for each precision of the points
+PRECISIONS = {"n": 1, "u": 1000, "ms": 1000000, "s": 1000000000}
 
 
 def on_message(client, userdata, msg):
-    # Use utc as timestamp
-    receiveTime = datetime.datetime.utcnow()
-    message = msg.payload.decode("utf-8")
-    try:
-        metadata = msg.topic.split("/")
-        building, floor, room, object_type, object_name = metadata[:5]
-        metrics_name = metadata[6]
-    except:
-        # bad topic structure. End the function
-        return
+    # Use the receive time as timestamp, in nanoseconds since the epoch (utc). userdata is the ingest pipeline:
+    # the message is only handed off so that the paho loop is never blocked by InfluxDB.
+    userdata.submit(msg.topic, msg.payload, time.time_ns())
+
 
+def decode_value(payload):
+    """ return the value of a metric message: a finite float if possible, the string otherwise """
+    message = payload.decode("utf-8")
     try:
         # Convert the string to a float so that it is stored as a number and not a string in the database
-        message = float(message)
-        data_type = "numericValue"
-    except:
+        value = float(message)
+    except ValueError:
         # The message is not a float, this is not a problem
-        data_type = "textValue"
-
-    print(str(receiveTime) + ": " + msg.topic + " " + str(message))
-
-    json_body = [
-        {
-            "measurement": object_type,
-            "fields": {
-                data_type: message
-            },
-            "tags": {
-                "building": building,
-                "floor": floor,
-                "room": room,
-                "object_name": object_name,
-                "field_name": metrics_name
-            }
-        }
-    ]
-    dbclient.write_points(json_body)
+        return message
+    # InfluxDB does not accept nan and the infinities as numbers
+    return value if math.isfinite(value) else message
+
+
+def is_batch(topic):
+    """ tell whether a message carries the batched fields of an object """
+    return topic.endswith("/" + BATCH_CHANNEL) or topic.endswith("/" + BINARY_CHANNEL)
+
+
+def decode_batch(topic, payload):
+    """ return the fields {field_name: float or string} and the timestamp (None if absent) of a batched message,
+    without the values which cannot be stored in the field of their metric
+    """
+    fields, timestamp = decode_binary(payload) if topic.endswith(".bin") else decode_fields(payload)
+    if fields:
+        fields, count = storable_fields(fields)
+        if count:
+            skipped.count(count)
+    return fields, timestamp
+
+
+def make_json_point(topic_cache, topic, value, receiveTime):
+    """ build the point dictionary of a metric for the influxdb client, or None for a bad topic structure """
+    info = topic_cache.get(topic)
+    if not info.valid or info.batch:
+        return None
+
+    if not is_number(value):
+        value = str(value)
+    data_type = "numericValue" if isinstance(value, float) else "textValue"
+    # The point is written later by the batch writer, so the receive time must be stored with it
+    return {
+        "measurement": info.measurement,
+        "time": receiveTime,
+        "fields": {
+            data_type: value
+        },
+        # The client does not modify the tags so the cached dictionary can be shared
+        "tags": info.tags
+    }
+
+
+def make_json_batch_point(topic_cache, topic, fields, receiveTime):
+    """ build the point dictionary of a batched message, or None for a bad topic structure """
+    info = topic_cache.get(topic)
+    if not info.valid or not info.batch:
+        return None
+    return {
+        "measurement": info.measurement,
+        "time": receiveTime,
+        "fields": fields,
+        "tags": info.tags
+    }
+
+
+def process_metric_json(writer, topic_cache, divisor, topic, payload, receiveTime):
+    """ turn a metric message into a point dictionary and give it to the batch writer.
+    The timestamps in nanoseconds are divided by divisor to get the precision of the points.
+    """
+    if is_batch(topic):
+        fields, timestamp = decode_batch(topic, payload)
+        if timestamp is None:
+            timestamp = receiveTime
+        point = make_json_batch_point(topic_cache, topic, fields, timestamp // divisor) if fields else None
+        if point is None:
+            # bad topic or payload structure. End the function
+            return
+        message_log.debug("%d: %s %s", timestamp, topic, fields)
+        throughput.count(len(fields))
+        writer.write(point)
+        return
+
+    value = decode_value(payload)
+    point = make_json_point(topic_cache, topic, value, receiveTime // divisor)
+    if point is None:
+        # bad topic structure. End the function
+        return
+    message_log.debug("%d: %s %s", receiveTime, topic, value)
+    throughput.count()
+    writer.write(point)
+
+
+def process_metric_line(writer, encoder, divisor, topic, payload, receiveTime):
+    """ encode a metric message directly in line protocol and give the line to the batch writer.
+    The timestamps in nanoseconds are divided by divisor to get the precision of the points.
+    """
+    if is_batch(topic):
+        fields, timestamp = decode_batch(topic, payload)
+        if timestamp is None:
+            timestamp = receiveTime
+        line = encoder.encode_batch(topic, fields, timestamp // divisor)
+        if line is None:
+            # bad topic or payload structure. End the function
+            return
+        message_log.debug("%d: %s %s", timestamp, topic, fields)
+        throughput.count(len(fields))
+        writer.write(line)
+        return
+
+    value = decode_value(payload)
+    line = encoder.encode(topic, value, receiveTime // divisor)
+    if line is None:
+        # bad topic structure. End the function
+        return
+    message_log.debug("%d: %s %s", receiveTime, topic, value)
+    throughput.count()
+    writer.write(line)
 
 
 def on_publish(mqttc, obj, mid):
-    print("mid: " + str(mid))
+    logger.debug("mid: %s", mid)
 
 
 def on_log(mqttc, obj, level, string):
-    print(string)
+    logger.debug(string)
 
 
-# Set up a client for InfluxDB
-print("### InfluxDB Client  ###")
-dbclient = InfluxDBClient('localhost', 8086, '', '', 'cps2_project')
-dbclient.create_database('cps2_project')
+def log_stats(pipeline, writer, topic_cache):
+    """ log the counters of each stage """
+    logger.info("Pipeline stats: %s", json.dumps(pipeline.stats()))
+    logger.info("Topic cache stats: %s", json.dumps(topic_cache.stats()))
+    logger.info("Batch writer stats: %s", json.dumps(writer.stats()))
 
-mqttc = mqtt.Client()
-mqttc.on_message = on_message
-mqttc.on_publish = on_publish
 
-# Uncomment to enable debug messages
-# mqttc.on_log = on_log
-mqttc.connect("localhost", 1883)
-mqttc.subscribe("+/+/+/+/+/metrics/+")
+def report_stats(pipeline, writer, topic_cache, interval, report=None):
+    """ log the counters periodically, and give them to report if it is set """
+    while True:
+        time.sleep(interval)
+        log_stats(pipeline, writer, topic_cache)
+        if report is not None:
+            report({"pipeline": pipeline.stats(), "writer": writer.stats()})
+
+
+def make_argument_parser(description="Store the metrics published by the objects in InfluxDB."):
+    """ return the parser of the pipeline and batching settings """
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--mode", choices=PIPELINES.keys(), default="threads",
+                        help="how the messages are processed after being received (default: threads)")
+    parser.add_argument("--workers", type=int, default=4,
+                        help="number of worker threads or consumer coroutines (default: 4)")
+    parser.add_argument("--pipeline-queue-size", type=int, default=10000,
+                        help="maximum number of messages waiting to be processed (default: 10000)")
+    parser.add_argument("--encoding", choices=("line", "json"), default="line",
+                        help="how the points are encoded for InfluxDB: directly in line protocol, or as dictionaries "
+                             "serialized by the influxdb client (default: line)")
+    parser.add_argument("--precision", choices=PRECISIONS.keys(), default="n",
+                        help="precision of the timestamps of the points: n, u, ms or s (default: n)")
+    parser.add_argument("--topic-cache-size", type=int, default=10000,
+                        help="maximum number of parsed topics kept in memory (default: 10000)")
+    parser.add_argument("--batch-size", type=int, default=500,
+                        help="number of points written to InfluxDB at once (default: 500)")
+    parser.add_argument("--flush-interval", type=float, default=1.0,
+                        help="maximum time in seconds a point waits before being written (default: 1.0)")
+    parser.add_argument("--queue-size", type=int, default=10000,
+                        help="maximum number of points buffered in memory (default: 10000)")
+    parser.add_argument("--drop-policy", choices=BatchWriter.DROP_POLICIES, default="drop-oldest",
+                        help="what to do with new points when the buffer is full (default: drop-oldest)")
+    parser.add_argument("--stats-interval", type=float, default=60.0,
+                        help="period in seconds of the counters report, 0 to disable (default: 60)")
+    parser.add_argument("--log-level", default=None,
+                        help="DEBUG to log the received metrics (default: $CPS2_LOG_LEVEL or INFO)")
+    parser.add_argument("--log-sample", type=int, default=None,
+                        help="log only 1 received metric out of N (default: $CPS2_LOG_SAMPLE or 100)")
+    return parser
+
+
+def parse_arguments():
+    """ read the pipeline and batching settings from the command line """
+    return make_argument_parser().parse_args()
+
+
+def run(args, topics=METRIC_TOPICS, accept=None, report=None):
+    """ store the metrics received on the topics until the subscriber is stopped (Ctrl+C or SIGTERM).
+    If accept is set, only the messages whose topic is accepted are processed.
+    If report is set, it is called with the counters of the pipeline and the batch writer at each stats interval.
+    """
+    # Set up a client for InfluxDB
+    logger.info("### InfluxDB Client  ###")
+    dbclient = influxdb_client()
+    dbclient.create_database(get_config("influxdb")["database"])
+
+    writer = BatchWriter(dbclient,
+                         batch_size=args.batch_size,
+                         flush_interval=args.flush_interval,
+                         max_queue_size=args.queue_size,
+                         drop_policy=args.drop_policy,
+                         protocol=args.encoding,
+                         time_precision=args.precision)
+    topic_cache = TopicCache(args.topic_cache_size)
+    if args.encoding == "line":
+        handler = functools.partial(process_metric_line, writer, LineProtocolEncoder(topic_cache),
+                                    PRECISIONS[args.precision])
+    else:
+        handler = functools.partial(process_metric_json, writer, topic_cache, PRECISIONS[args.precision])
+    pipeline = create_pipeline(args.mode,
+                               handler,
+                               workers=args.workers,
+                               max_queue_size=args.pipeline_queue_size)
+    pipeline.start()
+    if args.stats_interval > 0:
+        threading.Thread(target=report_stats, args=(pipeline, writer, topic_cache, args.stats_interval, report),
+                         daemon=True).start()
+        throughput.interval = args.stats_interval
+        throughput.start()
+        skipped.interval = args.stats_interval
+        skipped.start()
+
+    mqttc = mqtt_client(userdata=pipeline)
+    if accept is None:
+        mqttc.on_message = on_message
+    else:
+        mqttc.on_message = lambda client, userdata, msg: accept(msg.topic) and on_message(client, userdata, msg)
+    mqttc.on_publish = on_publish
+
+    # Uncomment to enable debug messages
+    # mqttc.on_log = on_log
+    mqtt_connect(mqttc, default_host=DEFAULT_BROKER)
+    mqttc.subscribe([(topic, 0) for topic in topics])
+
+    # Stop the MQTT loop properly on SIGTERM so that the buffered points are flushed
+    signal.signal(signal.SIGTERM, lambda signum, frame: mqttc.disconnect())
+    try:
+        mqttc.loop_forever()
+    except KeyboardInterrupt:
+        mqttc.disconnect()
+    finally:
+        logger.info("Processing the queued messages and flushing the buffered points.")
+        pipeline.close()
+        writer.close()
+        log_stats(pipeline, writer, topic_cache)
+
 
-mqttc.loop_forever()
+if __name__ == '__main__':
+    args = parse_arguments()
+    setup_logging(args.log_level, args.log_sample)
+    run(args)
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+#
+# File: ingest_pipeline.py
+#
+# ### Description
+# Hand-off stage between the paho network thread and the processing of the metrics.
+#
+# ### Features
+# The paho callback only submits the raw message to a pipeline and returns, so a slow InfluxDB never blocks the MQTT
+# loop. Three modes are available:
+# - "inline": the message is processed in the paho callback (the historical behaviour)
+# - "threads": the message is put in a bounded queue consumed by a pool of worker threads
+# - "asyncio": the message is put in an asyncio queue consumed by coroutines running in a dedicated event loop, which
+#   run the processing in a pool of executor threads so that the coroutines overlap
+#
+# In the queued modes a message is dropped (and counted) when the queue is full instead of blocking the paho loop.
+# In the asyncio mode the queue is only accessed from the event loop, so the number of pending messages is counted in
+# the paho thread, and a message is dropped before being handed to the event loop.
+# Each pipeline reports its queue depth and the latency of each stage: the time spent waiting in the queue and the
+# time spent processing the message (parsing and handing the point to the batch writer).
+#
+####################################################################################################
+
+import asyncio
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class LatencyStats:
+    """ count, average and maximum duration of a stage """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, duration):
+        with self.lock:
+            self.count += 1
+            self.total += duration
+            if duration > self.max:
+                self.max = duration
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "count": self.count,
+                "avg": self.total / self.count if self.count else 0.0,
+                "max": self.max
+            }
+
+
+class InlinePipeline:
+    """ process the messages directly in the paho callback """
+
+    mode = "inline"
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.process_latency = LatencyStats()
+        self.errors = 0
+
+    def start(self):
+        pass
+
+    def submit(self, topic, payload, receive_time):
+        self._process(topic, payload, receive_time)
+        return True
+
+    def _process(self, topic, payload, receive_time):
+        start = time.monotonic()
+        try:
+            self.handler(topic, payload, receive_time)
+        except Exception as e:
+            self.errors += 1
+            logger.error("Unable to process the message on topic %s: %s", topic, e)
+        self.process_latency.add(time.monotonic() - start)
+
+    def queue_depth(self):
+        return 0
+
+    def close(self):
+        pass
+
+    def stats(self):
+        return {
+            "mode": self.mode,
+            "queue_depth": self.queue_depth(),
+            "errors": self.errors,
+            "process_latency": self.process_latency.snapshot()
+        }
+
+
+class ThreadPoolPipeline(InlinePipeline):
+    """ process the messages in a pool of worker threads fed by a bounded queue """
+
+    mode = "threads"
+
+    def __init__(self, handler, workers=4, max_queue_size=10000):
+        super().__init__(handler)
+        self.workers = workers
+        self.queue = queue.Queue(max_queue_size)
+        self.threads = []
+        self.queue_latency = LatencyStats()
+        self.dropped = 0
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name="ingest-worker-" + str(i), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, topic, payload, receive_time):
+        try:
+            self.queue.put_nowait((topic, payload, receive_time, time.monotonic()))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def _work(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            topic, payload, receive_time, submit_time = item
+            self.queue_latency.add(time.monotonic() - submit_time)
+            self._process(topic, payload, receive_time)
+
+    def queue_depth(self):
+        return self.queue.qsize()
+
+    def close(self):
+        """ process the queued messages then stop the workers """
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+
+    def stats(self):
+        stats = super().stats()
+        stats["dropped"] = self.dropped
+        stats["queue_latency"] = self.queue_latency.snapshot()
+        return stats
+
+
+class AsyncioPipeline(ThreadPoolPipeline):
+    """ process the messages in coroutines running in a dedicated event loop """
+
+    mode = "asyncio"
+
+    def __init__(self, handler, workers=4, max_queue_size=10000):
+        super().__init__(handler, workers, max_queue_size)
+        self.max_queue_size = max_queue_size
+        self.loop = asyncio.new_event_loop()
+        self.queue = None
+        self.thread = threading.Thread(target=self.loop.run_forever, name="ingest-event-loop", daemon=True)
+        self.tasks = []
+        # The handler blocks (e.g. the batch writer with the "block" policy), so it runs outside of the event loop
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ingest-worker")
+        # Messages submitted and not yet taken by a consumer, protected by the lock
+        self.pending = 0
+        self.lock = threading.Lock()
+
+    def start(self):
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self._start_consumers(), self.loop).result()
+
+    async def _start_consumers(self):
+        # The queue must be created in the event loop thread. It is bounded by the pending counter of submit().
+        self.queue = asyncio.Queue()
+        self.tasks = [self.loop.create_task(self._consume()) for _ in range(self.workers)]
+
+    def submit(self, topic, payload, receive_time):
+        # Called from the paho thread: the queue is only accessed from the event loop thread
+        with self.lock:
+            if self.pending >= self.max_queue_size:
+                self.dropped += 1
+                return False
+            self.pending += 1
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, (topic, payload, receive_time, time.monotonic()))
+        return True
+
+    async def _consume(self):
+        while True:
+            item = await self.queue.get()
+            if item is None:
+                return
+            with self.lock:
+                self.pending -= 1
+            topic, payload, receive_time, submit_time = item
+            self.queue_latency.add(time.monotonic() - submit_time)
+            await self.loop.run_in_executor(self.executor, self._process, topic, payload, receive_time)
+
+    def queue_depth(self):
+        with self.lock:
+            return self.pending
+
+    def close(self):
+        """ process the queued messages then stop the consumers and the event loop """
+        async def stop():
+            for _ in self.tasks:
+                await self.queue.put(None)
+            await asyncio.gather(*self.tasks)
+        asyncio.run_coroutine_threadsafe(stop(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.executor.shutdown()
+
+
+PIPELINES = {
+    InlinePipeline.mode: InlinePipeline,
+    ThreadPoolPipeline.mode: ThreadPoolPipeline,
+    AsyncioPipeline.mode: AsyncioPipeline
+}
+
+
+def create_pipeline(mode, handler, workers=4, max_queue_size=10000):
+    """ build the pipeline corresponding to the mode chosen at startup """
+    if mode == InlinePipeline.mode:
+        return InlinePipeline(handler)
+    return PIPELINES[mode](handler, workers, max_queue_size)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+#
+# File: line_protocol.py
+#
+# ### Description
+# Direct encoder from a metric message to the InfluxDB line protocol.
+#
+# ### Features
+# The influxdb client turns each point dictionary into a line of the form:
+# <measurement>,<tag_key>=<tag_value>,... <field_key>=<field_value> <timestamp>
+# Building the dictionary and serializing it again costs a lot of allocations on the hottest path of the subscriber.
+# Since the measurement and the tags only depend on the topic (building/floor/room/object_type/object_name/metrics_name),
+# the escaped "<measurement>,<tags> " prefix is computed once per topic and cached (see topic_cache.py), so that
+# encoding a point is a single string concatenation.
+#
+# A per-field message gives a point with a single field, "numericValue" or "textValue", and the tag "field_name".
+# A batched message (see common/metrics_codec.py) gives a single point with one field per metric name.
+#
+# nan and the infinities are not accepted by InfluxDB as numbers, so they are written as text.
+#
+# See the format [here](https://docs.influxdata.com/influxdb/v1.4/write_protocols/line_protocol_reference/).
+#
+####################################################################################################
+
+import math
+
+
+def is_number(value):
+    """ tell whether a value is written as a number: a finite float """
+    return isinstance(value, float) and math.isfinite(value)
+
+
+def escape_measurement(value):
+    """ escape the special characters of a measurement name """
+    return value.replace("\\", "\\\\").replace(",", "\\,").replace(" ", "\\ ").replace("\n", "\\n")
+
+
+def escape_tag(value):
+    """ escape the special characters of a tag key or a tag value """
+    return value.replace("\\", "\\\\").replace(",", "\\,").replace("=", "\\=").replace(" ", "\\ ")\
+        .replace("\n", "\\n")
+
+
+def escape_string_field(value):
+    """ quote a string field value """
+    return "\"" + value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") + "\""
+
+
+def encode_field(value):
+    """ return the "<field_key>=<field_value>" part of a line """
+    if is_number(value):
+        return "numericValue=" + repr(value)
+    return "textValue=" + escape_string_field(str(value))
+
+
+def encode_fields(fields):
+    """ return the "<field_key>=<field_value>,..." part of a line with one field per metric name """
+    return ",".join(escape_tag(name) + "=" + (repr(value) if is_number(value) else escape_string_field(str(value)))
+                    for name, value in fields.items())
+
+
+def make_prefix(object_type, tags):
+    """ build the "<measurement>,<tags> " part of a line. The tags are sorted by key as recommended by InfluxDB. """
+    prefix = escape_measurement(object_type)
+    for key in sorted(tags):
+        if tags[key]:
+            prefix += "," + escape_tag(key) + "=" + escape_tag(tags[key])
+    return prefix + " "
+
+
+class LineProtocolEncoder:
+    """ encode metric messages into lines, with the tag strings cached per topic """
+
+    def __init__(self, topic_cache):
+        # The topic cache holds the escaped prefix of each topic (see topic_cache.py)
+        self.topic_cache = topic_cache
+
+    def encode(self, topic, value, timestamp):
+        """ return the line of a metric, or None if the topic is not a per-field metric topic.
+        The value is stored in the field "numericValue" if it is a float, "textValue" otherwise.
+        The timestamp is an integer number of nanoseconds since the epoch.
+        """
+        info = self.topic_cache.get(topic)
+        if not info.valid or info.batch:
+            return None
+        return info.prefix + encode_field(value) + " " + str(timestamp)
+
+    def encode_batch(self, topic, fields, timestamp):
+        """ return the line of a batched message (a dictionary {field_name: float or string}),
+        or None if the topic is not a batched metrics topic or if there is no field
+        """
+        info = self.topic_cache.get(topic)
+        if not info.valid or not info.batch or not fields:
+            return None
+        return info.prefix + encode_fields(fields) + " " + str(timestamp)
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+#
+# File: sharded_subscriber.py
+#
+# ### Description
+# Run the InfluxDB subscriber in several worker processes, each one storing a partition of the metrics, so that the
+# ingestion is not bound to one core and one MQTT connection.
+#
+# ### Features
+# The supervisor starts --shards worker processes (see run() in influxdb_subscriber.py), monitors them and restarts a
+# worker which crashes (after a delay if it crashed soon after being started). The topic space is partitioned with
+# --strategy:
+# - "share": the workers subscribe to the metric topics through an MQTT shared subscription ($share/<group>/...), and
+#   the broker distributes the messages between them. The broker must support shared subscriptions (e.g. Mosquitto 1.6+).
+# - "hash": each topic belongs to the shard crc32(<key>) % shards, where the key is the building or the object type
+#   of the topic (--shard-key). When the keys are known in advance (--shard-keys), each worker only subscribes to the
+#   topics of its keys, so the broker does the filtering. Otherwise each worker receives all the metrics and drops the
+#   ones of the other shards before processing them.
+#
+# Every --stats-interval seconds, the workers send the counters of their pipeline and batch writer to the supervisor,
+# which logs the totals and the throughput of the whole subscriber.
+#
+# All the options of influxdb_subscriber.py are accepted and given to each worker (run with --help).
+#
+# ### Dependencies
+# - paho-mqtt (sudo pip3 install paho-mqtt)
+# - influxdb (sudo apt-get install python3-influxdb)
+#
+####################################################################################################
+
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+import time
+import zlib
+
+from influxdb_subscriber import METRIC_TOPICS, make_argument_parser, run
+
+# The shared modules are in the "common" directory at the root of the repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from cps2_logging import setup_logging
+
+logger = logging.getLogger("sharded_subscriber")
+
+STRATEGIES = ("share", "hash")
+# level of the topics used as the key of the "hash" strategy
+SHARD_KEYS = {"building": 0, "object_type": 3}
+# counters of the workers added up by the supervisor
+SUMMED_COUNTERS = (("writer", "points_received"), ("writer", "points_written"), ("writer", "points_dropped"),
+                   ("writer", "points_rejected"), ("writer", "write_errors"), ("writer", "queue_depth"),
+                   ("pipeline", "dropped"), ("pipeline", "errors"), ("pipeline", "queue_depth"))
+
+
+def shard_of(key, shards):
+    """ return the shard of a key. crc32 is used because it is the same in all the processes, unlike hash(). """
+    return zlib.crc32(key.encode("utf-8")) % shards
+
+
+def key_topics(shard_key, key):
+    """ return the metric topics of a building or an object type """
+    level = SHARD_KEYS[shard_key]
+    topics = []
+    for topic in METRIC_TOPICS:
+        levels = topic.split("/")
+        levels[level] = key
+        topics.append("/".join(levels))
+    return topics
+
+
+class TopicFilter:
+    """ accept the topics of one shard, for the "hash" strategy without known keys """
+
+    def __init__(self, shard_key, shard, shards):
+        self.level = SHARD_KEYS[shard_key]
+        self.shard = shard
+        self.shards = shards
+
+    def __call__(self, topic):
+        levels = topic.split("/", self.level + 1)
+        return len(levels) > self.level and shard_of(levels[self.level], self.shards) == self.shard
+
+
+def worker_subscriptions(args, shard):
+    """ return the topics and the topic filter of a worker """
+    if args.strategy == "share":
+        return ["$share/" + args.share_group + "/" + topic for topic in METRIC_TOPICS], None
+    if args.shard_keys:
+        topics = []
+        for key in args.shard_keys.split(","):
+            if shard_of(key, args.shards) == shard:
+                topics.extend(key_topics(args.shard_key, key))
+        return topics, None
+    return list(METRIC_TOPICS), TopicFilter(args.shard_key, shard, args.shards)
+
+
+def worker_main(args, shard, stats_queue):
+    """ entry point of a worker process """
+    setup_logging(args.log_level, args.log_sample)
+    topics, accept = worker_subscriptions(args, shard)
+    if not topics:
+        logger.warning("Shard %d/%d: none of the keys belongs to this shard, nothing to subscribe to",
+                       shard, args.shards)
+        return
+    logger.info("Shard %d/%d (pid %d): subscribing to %s%s", shard, args.shards, os.getpid(), ", ".join(topics),
+                ", filtering on the " + args.shard_key if accept is not None else "")
+    run(args, topics, accept, lambda stats: stats_queue.put((shard, stats)))
+
+
+class Supervisor:
+    """ start, monitor and restart the worker processes, and add up their counters """
+
+    def __init__(self, args, restart_delay=5.0):
+        self.args = args
+        self.restart_delay = restart_delay
+        # Spawned processes start with a fresh interpreter (and their own logging thread)
+        self.context = multiprocessing.get_context("spawn")
+        self.stats_queue = self.context.Queue()
+        # shard -> process, start time, and latest counters
+        self.processes = {}
+        self.started = {}
+        self.stats = {}
+        self.restarts = 0
+        self.running = True
+        self.last_points = 0
+        self.last_report = time.monotonic()
+
+    def start(self, shard):
+        """ start the worker of a shard """
+        process = self.context.Process(target=worker_main, args=(self.args, shard, self.stats_queue),
+                                       name="influxdb-shard-" + str(shard))
+        process.start()
+        self.processes[shard] = process
+        self.started[shard] = time.monotonic()
+
+    def run(self):
+        """ start all the workers and supervise them until stopped """
+        for shard in range(self.args.shards):
+            self.start(shard)
+        while self.running:
+            self.collect_stats(1.0)
+            self.check_workers()
+            if self.args.stats_interval > 0 and time.monotonic() - self.last_report >= self.args.stats_interval:
+                self.log_stats()
+        self.stop()
+
+    def check_workers(self):
+        """ restart the workers which have crashed """
+        now = time.monotonic()
+        for shard, process in self.processes.items():
+            # A worker exits normally only if it has nothing to subscribe to
+            if process.is_alive() or process.exitcode == 0 or not self.running:
+                continue
+            if now - self.started[shard] < self.restart_delay:
+                # Do not restart a crashing worker in a loop
+                continue
+            logger.warning("Shard %d exited with code %s, restarting it", shard, process.exitcode)
+            self.restarts += 1
+            self.start(shard)
+
+    def collect_stats(self, timeout):
+        """ receive the counters sent by the workers """
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                shard, stats = self.stats_queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                return
+            self.stats[shard] = stats
+
+    def totals(self):
+        """ add up the latest counters of the workers """
+        totals = {stage + "_" + counter: 0 for stage, counter in SUMMED_COUNTERS}
+        for stats in self.stats.values():
+            for stage, counter in SUMMED_COUNTERS:
+                totals[stage + "_" + counter] += stats.get(stage, {}).get(counter, 0)
+        totals["workers_alive"] = sum(process.is_alive() for process in self.processes.values())
+        totals["restarts"] = self.restarts
+        return totals
+
+    def log_stats(self):
+        """ log the totals and the throughput of all the workers """
+        now = time.monotonic()
+        totals = self.totals()
+        rate = (totals["writer_points_received"] - self.last_points) / (now - self.last_report)
+        self.last_points = totals["writer_points_received"]
+        self.last_report = now
+        logger.info("%d shards: %.1f points/s, totals: %s", self.args.shards, rate, totals)
+
+    def stop(self):
+        """ stop the workers: they flush their buffered points on SIGTERM """
+        self.running = False
+        for process in self.processes.values():
+            if process.is_alive():
+                process.terminate()
+        for process in self.processes.values():
+            process.join()
+        logger.info("All the shards are stopped")
+
+
+def parse_arguments():
+    """ read the sharding settings and the settings of the workers from the command line """
+    parser = make_argument_parser("Store the metrics published by the objects in InfluxDB with several processes.")
+    parser.add_argument("--shards", type=int, default=os.cpu_count() or 1,
+                        help="number of worker processes (default: number of CPUs)")
+    parser.add_argument("--strategy", choices=STRATEGIES, default="share",
+                        help="share: MQTT shared subscription, hash: partition by building or object type "
+                             "(default: share)")
+    parser.add_argument("--share-group", default="cps2-influxdb",
+                        help="name of the shared subscription group (default: cps2-influxdb)")
+    parser.add_argument("--shard-key", choices=SHARD_KEYS.keys(), default="building",
+                        help="level of the topics hashed by the hash strategy (default: building)")
+    parser.add_argument("--shard-keys", default=None,
+                        help="comma separated list of the buildings or object types, to subscribe each worker to "
+                             "its own keys only (hash strategy)")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    setup_logging(args.log_level, args.log_sample)
+
+    supervisor = Supervisor(args)
+
+    def stop(signum, frame):
+        supervisor.running = False
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    supervisor.run()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+#
+# File: topic_cache.py
+#
+# ### Description
+# Cache of the metadata parsed from the metric topics:
+# <building>/<floor>/<room>/<object_type>/<object_name>/metrics/<metrics_name> (one field per message)
+# <building>/<floor>/<room>/<object_type>/<object_name>/batch/metrics (batched fields, see common/metrics_codec.py)
+# <building>/<floor>/<room>/<object_type>/<object_name>/batch/metrics.bin (batched fields, binary payload)
+#
+# ### Features
+# The set of distinct topics is small and stable (one per object per metric), so each topic is parsed once and the
+# result (measurement, tags, validity and line protocol prefix) is reused for all the following messages. The cache is
+# bounded and evicts the least recently used topics, so that a misbehaving publisher sending many distinct topics
+# cannot make the memory grow without limit. Invalid topics are cached too. The hits, misses and evictions are counted.
+#
+####################################################################################################
+
+import threading
+from collections import OrderedDict, namedtuple
+
+from line_protocol import make_prefix
+
+# level of the topics of the batched metrics after the object name, and last level (JSON and binary payloads)
+BATCH_LEVEL = "batch"
+BATCH_CHANNELS = ("metrics", "metrics.bin")
+
+# valid: whether the topic has the metric structure. The other attributes are None for an invalid topic.
+# prefix: the escaped "<measurement>,<tags> " part of a line protocol point
+# batch: whether the messages of the topic carry several fields (no field_name tag)
+TopicInfo = namedtuple("TopicInfo", ["valid", "measurement", "tags", "prefix", "batch"])
+
+INVALID_TOPIC = TopicInfo(False, None, None, None, None)
+
+
+def parse_topic(topic):
+    """ parse a metric topic, return a TopicInfo """
+    metadata = topic.split("/")
+    if len(metadata) != 7:
+        return INVALID_TOPIC
+    batch = metadata[5] == BATCH_LEVEL
+    if metadata[5] != "metrics" and not (batch and metadata[6] in BATCH_CHANNELS):
+        return INVALID_TOPIC
+    # An empty level would give an empty measurement, tag or field name, which InfluxDB rejects
+    if not all(metadata):
+        return INVALID_TOPIC
+    building, floor, room, object_type, object_name = metadata[:5]
+    tags = {
+        "building": building,
+        "floor": floor,
+        "room": room,
+        "object_name": object_name
+    }
+    if not batch:
+        tags["field_name"] = metadata[6]
+    return TopicInfo(True, object_type, tags, make_prefix(object_type, tags), batch)
+
+
+class TopicCache:
+    """ LRU-bounded cache of the parsed topics """
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        # The cache is shared by the workers of the ingest pipeline
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, topic):
+        """ return the TopicInfo of a topic, parsing it only if it is not cached """
+        with self.lock:
+            info = self.entries.get(topic)
+            if info is not None:
+                self.entries.move_to_end(topic)
+                self.hits += 1
+                return info
+            self.misses += 1
+
+        info = parse_topic(topic)
+        with self.lock:
+            self.entries[topic] = info
+            if len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        return info
+
+    def stats(self):
+        """ return the counters of the cache """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / lookups if lookups else 0.0
+            }
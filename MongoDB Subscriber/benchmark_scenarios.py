@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+#
+# File: benchmark_scenarios.py
+#
+# ### Description
+# Benchmark of the activation latency of a scenario with thousands of targets: walking the scenario document at each
+# activation (the previous behaviour of apply_scenario) versus publishing a plan compiled once.
+#
+# ### Usage
+# python3 benchmark_scenarios.py [number_of_targets]
+#
+# The messages are given to a publisher which only counts them, so that only the cost of the activation itself is
+# measured (no broker needed).
+#
+####################################################################################################
+
+import sys
+import timeit
+
+from scenario_plan import compile_scenario
+
+
+class NullPublisher:
+	def __init__(self):
+		self.count = 0
+
+	def publish(self, topic, payload):
+		self.count += 1
+
+
+# a scenario targeting each object of a campus individually
+def make_scenario(targets):
+	configs = []
+	for i in range(targets):
+		configs.append({
+			"targets": {"building": "B" + str(i % 10), "floor": str(i % 7), "room": "R" + str(i % 50),
+						"type": "Lamp", "name": "lamp" + str(i)},
+			"config": {"publishing_mode": "on-demand", "response_latency": 0},
+			"fields": {"status": "OFF", "brightness": 0}
+		})
+	return {"scenario_id": 1000, "scenario_name": "benchmark", "configs": configs}
+
+
+# the activation as it was done before the plans: the document is walked and the messages built each time
+def walk_and_publish(publisher, scenario):
+	if 'configs' in scenario.keys():
+		for obj in scenario['configs']:
+			if 'targets' in obj.keys():
+				targets = obj['targets']
+				for section, prefix in (('config', "config,"), ('fields', "field,")):
+					if section in obj.keys():
+						values = obj[section]
+						for key in values.keys():
+							body = prefix + key + "," + str(values[key])
+							topic = targets['building'] + "/" + targets['floor'] + "/" + targets['room'] + "/" \
+								+ targets['type'] + "/" + targets['name'] + "/change"
+							publisher.publish(topic, body)
+
+
+def publish_plan(publisher, plan):
+	publish = publisher.publish
+	for topic, payload in plan:
+		publish(topic, payload)
+
+
+if __name__ == '__main__':
+	targets = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+	scenario = make_scenario(targets)
+	publisher = NullPublisher()
+
+	# The legacy format has the same messages as the walk, one per key
+	compile_time = min(timeit.repeat(lambda: compile_scenario(scenario, "legacy"), number=1, repeat=5))
+	plan = compile_scenario(scenario, "legacy")
+	print("{} targets, {} messages, compiled once in {:.2f} ms".format(targets, len(plan), compile_time * 1000))
+
+	bulk_plan = compile_scenario(scenario, "bulk")
+	for name, function in (("walk the document", lambda: walk_and_publish(publisher, scenario)),
+						   ("compiled plan", lambda: publish_plan(publisher, plan)),
+						   ("compiled bulk plan", lambda: publish_plan(publisher, bulk_plan))):
+		duration = min(timeit.repeat(function, number=1, repeat=5))
+		print("{:<20} {:>8.2f} ms per activation".format(name, duration * 1000))
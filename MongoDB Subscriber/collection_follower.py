@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+#
+# File: collection_follower.py
+#
+# ### Description
+# Base class of the in-memory copies of a MongoDB collection (scenario cache, object index) which are kept up to date
+# by a background thread.
+#
+# ### Features
+# The subclass loads the whole collection in reload() and applies the changes of a single document in put() and
+# remove(). After the initial load, a background thread follows the changes of the collection:
+# - with a MongoDB change stream when the server supports it (replica set), the inserted, replaced, updated and deleted
+#   documents are applied as soon as they are written
+# - otherwise the hash of the collection (dbHash command) is polled and the whole collection is reloaded when it changes
+#
+# ### Dependencies:
+# - pymongo (`sudo pip3 install pymongo`)
+#
+####################################################################################################
+
+import logging
+import threading
+import time
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+
+class CollectionFollower:
+	def __init__(self, collection, name, poll_interval=5.0, pipeline=None):
+		self.collection = collection
+		# name of the documents in the logs
+		self.name = name
+		self.poll_interval = poll_interval
+		# aggregation pipeline filtering the events of the change stream
+		self.pipeline = pipeline
+		self.lock = threading.Lock()
+		self.thread = None
+
+	# load the whole collection. Must be implemented by the subclass.
+	def reload(self):
+		raise NotImplementedError("Must override method reload")
+
+	# add or replace a document. Must be implemented by the subclass.
+	def put(self, document):
+		raise NotImplementedError("Must override method put")
+
+	# remove a document by its MongoDB _id. Must be implemented by the subclass.
+	def remove(self, mongo_id):
+		raise NotImplementedError("Must override method remove")
+
+	# load the collection and start following its changes
+	def start(self):
+		self.reload()
+		self.thread = threading.Thread(target=self.follow_changes, name=self.name + "-follower", daemon=True)
+		self.thread.start()
+
+	# follow the changes forever, with a change stream if possible, by polling otherwise
+	def follow_changes(self):
+		while True:
+			try:
+				self.watch()
+			except OperationFailure as e:
+				# Change streams are only available on replica sets
+				logger.info("Change streams not available (%s), polling the %s every %s s",
+							e, self.name, self.poll_interval)
+				self.poll()
+			except PyMongoError as e:
+				logger.warning("Lost the change stream on the %s: %s. Reloading them.", self.name, e)
+				time.sleep(self.poll_interval)
+				self.safe_reload()
+			except Exception:
+				# A bug in the processing of a document must not stop the thread (and freeze the cache)
+				logger.exception("Error while following the %s, reloading them", self.name)
+				time.sleep(self.poll_interval)
+				self.safe_reload()
+
+	def watch(self):
+		with self.collection.watch(self.pipeline, full_document='updateLookup') as stream:
+			# Changes may have happened between the initial load and the opening of the stream
+			self.reload()
+			for change in stream:
+				operation = change['operationType']
+				if operation in ('insert', 'replace', 'update'):
+					if change.get('fullDocument'):
+						self.put(change['fullDocument'])
+					else:
+						# The document was deleted before the lookup
+						self.remove(change['documentKey']['_id'])
+				elif operation == 'delete':
+					self.remove(change['documentKey']['_id'])
+				else:
+					# drop, rename or invalidate: the stream is closed, start again from a full load
+					self.safe_reload()
+					return
+
+	def poll(self):
+		version = self.version()
+		while True:
+			time.sleep(self.poll_interval)
+			new_version = self.version()
+			# Without a version (e.g. dbHash not allowed) the collection is reloaded at each poll
+			if new_version is None or new_version != version:
+				if version is not None:
+					logger.info("The %s have changed, reloading them", self.name)
+				version = new_version
+				self.safe_reload()
+
+	# hash of the content of the collection, changes whenever a document is written. None if it is not available.
+	def version(self):
+		try:
+			result = self.collection.database.command("dbHash", collections=[self.collection.name])
+			return result['collections'].get(self.collection.name)
+		except PyMongoError as e:
+			logger.debug("Unable to get the version of the %s: %s", self.name, e)
+			return None
+
+	def safe_reload(self):
+		try:
+			self.reload()
+		except Exception as e:
+			logger.warning("Unable to reload the %s: %s", self.name, e)
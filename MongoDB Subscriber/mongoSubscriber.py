@@ -12,84 +12,175 @@
 # 2- parses it to get the configs array
 # 3- for each group of objects referred as targets in this array, it publishes the new state described in the dictionary "config" and/or "fields".
 #
+# The scenarios are kept in an in-process cache (see scenario_cache.py) loaded at startup and refreshed through a change stream
+# (or by polling when change streams are not available), so that activating a scenario does not need a round trip to MongoDB.
+# Each scenario is compiled once into a plan, the list of (topic, payload) messages to publish (see scenario_plan.py).
+# By default there is one bulk change message per group of targets (a JSON object with all its "config" and "fields"
+# changes, applied by the objects with a single database write); --payload-format legacy sends one message per key.
+#
+# The plans are published by a dedicated MQTT client with its own network thread (see scenario_publisher.py): the messages are
+# pipelined with a bounded number of messages in flight, and the total fan-out time of each scenario is logged. The QoS and the
+# in-flight window are set on the command line (--qos, --window), as well as the time after which a fan-out without
+# acknowledgements is stopped (--ack-timeout).
+#
+# The objects registered in the collection "objects" are kept in an in-memory index (see object_index.py), so the number of
+# objects targeted by each scenario is logged. --fan-out chooses how the messages reach the objects: "broadcast" (default)
+# publishes on the group topics (e.g. All/All/All/Lamp/All), "explicit" publishes on the topic of each targeted object, and
+# "auto" uses the group topic when the objects subscribe to it and it targets several objects, the object topics otherwise.
+#
+# At startup, a warning is logged for each index of common/cps2_schema.py which is missing in MongoDB (they are created by
+# DB utils/bootstrap_schema.py).
+#
+# The addresses of MongoDB and of the broker, and the settings of the clients (pool size, timeouts, keep-alive, ...) are read
+# from the environment or a JSON file (see common/cps2_config.py).
+#
 # ### Dependencies: 
 # - paho.mqtt (`sudo pip3 install paho-mqtt`)
 # - pymongo (`sudo pip3 install pymongo`)
 #
 ####################################################################################################
 
+import argparse
+import functools
 import time
 import json
+import logging
+import os
 import sys
 from datetime import datetime
 from abc import ABCMeta, abstractmethod
-from pymongo import MongoClient
-from paho.mqtt.client import Client
+from pymongo.errors import PyMongoError
+
+from object_index import ObjectIndex
+from scenario_cache import ScenarioCache
+from scenario_plan import FAN_OUT_MODES, PAYLOAD_FORMATS, compile_scenario, count_targets, resolve_scenario, target_topic
+from scenario_publisher import ScenarioPublisher
+
+# The shared modules are in the "common" directory at the root of the repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from cps2_config import mongo_client, mqtt_client, mqtt_connect
+from cps2_logging import setup_logging
+from cps2_schema import missing_indexes
+
+logger = logging.getLogger("mongoSubscriber")
 
 class MongoSubscriber:
-	def __init__(self):
-		print("### MongoDB Client ###")
-		self.Mclient = MongoClient("192.168.43.48")
-		self.init_mqtt_client("192.168.43.48")
+	def __init__(self, qos=0, window=1000, payload_format="bulk", fan_out="broadcast", ack_timeout=10.0):
+		logger.info("### MongoDB Client ###")
+		self.Mclient = mongo_client()
+		self.check_indexes()
+		self.payload_format = payload_format
+		self.fan_out = fan_out
+		# load the scenarios in memory and keep them up to date
+		self.scenario_cache = ScenarioCache(self.Mclient.cps2_project.scenarios,
+											compile=functools.partial(compile_scenario, payload_format=payload_format))
+		self.scenario_cache.start()
+		# know which objects exist, to count and optionally address the targets of the scenarios
+		self.object_index = ObjectIndex(self.Mclient.cps2_project.objects)
+		self.object_index.start()
+		# scenario_id -> (scenario, version of the object index, plan, number of objects targeted)
+		self.resolved = {}
+		# the scenarios are published by a dedicated client so that the fan-out is not delayed by this client's loop
+		self.publisher = ScenarioPublisher(qos=qos, window=window, ack_timeout=ack_timeout)
+		self.init_mqtt_client()
 		#self.test("2")
 		
-	#initiate connction to MQTT
-	def init_mqtt_client(self, host):
-		self.mqtt_client = Client()
-		self.mqtt_client.connect(host)
+	# warn if the indexes used to find the scenarios and the objects are missing (see DB utils/bootstrap_schema.py)
+	def check_indexes(self):
+		try:
+			missing = missing_indexes(self.Mclient.cps2_project)
+		except PyMongoError as e:
+			logger.warning("unable to check the indexes of MongoDB: %s", e)
+			return
+		for collection, name in missing:
+			logger.warning("missing index %s on the collection %s: the queries scan the whole collection, "
+						   "run DB utils/bootstrap_schema.py", name, collection)
+
+	#initiate connction to MQTT (to the broker of the settings if host is None)
+	def init_mqtt_client(self, host=None):
+		self.mqtt_client = mqtt_client()
+		mqtt_connect(self.mqtt_client, host)
 		def on_message(client, userdata, msg):
 			message_body=msg.payload.decode("utf-8")
-			scenario=self.get_scenario(message_body)
-			if scenario:
-				self.apply_scenario(scenario)
+			resolved=self.resolve(message_body)
+			if resolved is not None:
+				plan, targeted = resolved
+				self.publish_plan(plan, message_body)
+				logger.info("scenario %s: %d objects targeted (%s fan-out)", message_body, targeted, self.fan_out)
 			else:
-				print("unable to retrieve scenario:" +message_body)
+				logger.warning("unable to retrieve scenario: %s", message_body)
 		self.mqtt_client.on_message = on_message
 		topic="Scenario"
 		self.mqtt_client.subscribe(topic)
 		self.mqtt_client.loop_forever()
-	# retrive a scenario from MongoDB by scenario_id
+	# retrive a scenario by scenario_id from the cache, or from MongoDB if it is not cached
 	def get_scenario(self,scenario_id):
 		id = int(scenario_id)
-		return self.Mclient.cps2_project.scenarios.find_one({'scenario_id': id})
+		return self.scenario_cache.get(id)
+
+	# retrieve the compiled plan of a scenario by scenario_id
+	def get_plan(self,scenario_id):
+		id = int(scenario_id)
+		return self.scenario_cache.get_plan(id)
 		
+	# return the plan of a scenario for the registered objects and the number of objects it targets, None if it does not exist.
+	# The result is kept until the scenario or the locations of the objects change.
+	def resolve(self,scenario_id):
+		id = int(scenario_id)
+		scenario, compiled_plan = self.scenario_cache.get_with_plan(id)
+		if scenario is None:
+			return None
+		version = self.object_index.version
+		resolved = self.resolved.get(id)
+		if resolved is None or resolved[0] is not scenario or resolved[1] != version:
+			if self.fan_out == "broadcast":
+				# The compiled plan of the cache is already the broadcast plan: only the targets are counted
+				plan = compiled_plan
+				targeted = count_targets(scenario, self.object_index)
+			else:
+				plan, targeted = resolve_scenario(scenario, self.object_index, self.fan_out, self.payload_format)
+			resolved = self.resolved[id] = (scenario, version, plan, targeted)
+		return resolved[2], resolved[3]
+
 	# send mqtt message to set specific config 	
 	def set_config(self,building,level,room,type,name,newConfig):
-		obj_topic=building + "/" + level + "/" + room + "/" + type + "/" + name + "/change"
-		self.mqtt_client.publish(obj_topic, newConfig)
-		print("sent MQTT to "+obj_topic +" message: "+ newConfig)
+		obj_topic=target_topic(building,level,room,type,name)
+		self.publisher.publish(obj_topic, newConfig)
+		logger.debug("sent MQTT to %s message: %s", obj_topic, newConfig)
+
+	# hand all the messages of a compiled plan off to the publisher, which pipelines them
+	def publish_plan(self,plan,scenario_id=None):
+		self.publisher.submit(plan, scenario_id)
 		
-	# parse scenario document to topics and configs then call set_configs to each one
+	# compile a scenario document to topics and configs then publish them
 	def apply_scenario(self,scenario):
-		if 'configs' in scenario.keys():
-			for obj in scenario['configs']:
-				if 'targets' in obj.keys():
-					targets=obj['targets']
-					if 'config' in obj.keys():
-						conf=obj['config']
-						for key in conf.keys():
-							body = "config," + key + "," + str(conf[key])
-							self.set_config(targets['building'],targets['floor'],targets['room'],targets['type'],targets['name'],body)
-					if 'fields' in obj.keys():
-						fields=obj['fields']
-						for key in fields.keys():
-							body = "field," + key + "," + str(fields[key])
-							self.set_config(targets['building'],targets['floor'],targets['room'],targets['type'],targets['name'],body)
-				else:
-					print("no targets to publish")
-		else:
-			print("no configs in scenario")
-				
+		self.publish_plan(compile_scenario(scenario, self.payload_format), scenario.get('scenario_id'))
 				
 					
 	def test(self, msg):
 			
-			scenario=self.get_scenario(msg)
-			if scenario:
-				self.apply_scenario(scenario)
+			plan=self.get_plan(msg)
+			if plan is not None:
+				self.publish_plan(plan, msg)
 			else:
-				print("unable to retrieve scenario:" +msg)
+				logger.warning("unable to retrieve scenario: %s", msg)
 			
 		
 if __name__ == '__main__':
-    mongo_port = MongoSubscriber()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Apply the scenarios stored in MongoDB to the objects.")
+    parser.add_argument("--qos", type=int, choices=(0, 1, 2), default=0,
+                        help="QoS of the messages sent to the objects (default: 0)")
+    parser.add_argument("--window", type=int, default=1000,
+                        help="maximum number of messages in flight during a scenario fan-out (default: 1000)")
+    parser.add_argument("--ack-timeout", type=float, default=10.0,
+                        help="seconds to wait for a message to be sent or acknowledged before the fan-out of a "
+                             "scenario is stopped (default: 10)")
+    parser.add_argument("--payload-format", choices=PAYLOAD_FORMATS, default="bulk",
+                        help="bulk: one JSON message per group of targets, legacy: one message per key (default: bulk)")
+    parser.add_argument("--fan-out", choices=FAN_OUT_MODES, default="broadcast",
+                        help="broadcast: one message per group topic, explicit: one message per targeted object, "
+                             "auto: the cheapest of both for each group (default: broadcast)")
+    args = parser.parse_args()
+
+    setup_logging()
+    mongo_port = MongoSubscriber(args.qos, args.window, args.payload_format, args.fan_out, args.ack_timeout)
\ No newline at end of file
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+#
+# File: object_index.py
+#
+# ### Description
+# In-memory index of the objects registered in the collection "objects", to resolve the targets of a scenario to the
+# objects which actually exist.
+#
+# ### Features
+# The location of each object (building, floor, room, type, name) is loaded at startup and kept up to date by a
+# background thread (see collection_follower.py). For each level, the index maps a value to the objects which have
+# it, so a group of targets (where a level may be "All") is resolved by intersecting the sets of the levels which are
+# given, starting with the smallest one.
+#
+# The location of an object is written when it is created, so the change stream only follows the insertions,
+# replacements and deletions (not the frequent updates of the configuration and the fields).
+#
+# ### Dependencies:
+# - pymongo (`sudo pip3 install pymongo`)
+#
+####################################################################################################
+
+import logging
+
+from collection_follower import CollectionFollower
+
+logger = logging.getLogger(__name__)
+
+# fields of the object documents with the location, in the order of the levels of the topics
+LOCATION_FIELDS = ("building", "floor", "room", "object_type", "object_name")
+# keys of the targets of a scenario, in the same order
+TARGET_KEYS = ("building", "floor", "room", "type", "name")
+
+
+# location of an object document, None if it is incomplete
+def object_location(document):
+	try:
+		return tuple(str(document[field]['value']) for field in LOCATION_FIELDS)
+	except (KeyError, TypeError):
+		return None
+
+
+class ObjectIndex(CollectionFollower):
+	def __init__(self, collection, poll_interval=5.0):
+		super().__init__(collection, "objects", poll_interval,
+						 pipeline=[{'$match': {'operationType': {'$ne': 'update'}}}])
+		# MongoDB _id -> location of the object
+		self.locations = {}
+		# for each level: value -> set of the _id of the objects with this value
+		self.levels = tuple({} for _ in LOCATION_FIELDS)
+		# incremented when the locations change, to know when the targets must be resolved again
+		self.version = 0
+
+	def reload(self):
+		projection = {field + '.value': True for field in LOCATION_FIELDS}
+		locations = {}
+		levels = tuple({} for _ in LOCATION_FIELDS)
+		for document in self.collection.find({}, projection):
+			location = object_location(document)
+			if location is not None:
+				locations[document['_id']] = location
+				for level, value in zip(levels, location):
+					level.setdefault(value, set()).add(document['_id'])
+		with self.lock:
+			# When polling, the collection is reloaded at each write of an object (e.g. its last_modified), which
+			# seldom changes the locations: the resolved targets are only invalidated when they do
+			if locations != self.locations:
+				self.version += 1
+			self.locations = locations
+			self.levels = levels
+		logger.info("%d objects loaded in the index", len(locations))
+
+	def put(self, document):
+		location = object_location(document)
+		with self.lock:
+			if self.locations.get(document['_id']) == location:
+				return
+			self._remove(document['_id'])
+			self.version += 1
+			if location is not None:
+				self.locations[document['_id']] = location
+				for level, value in zip(self.levels, location):
+					level.setdefault(value, set()).add(document['_id'])
+
+	def remove(self, mongo_id):
+		with self.lock:
+			if mongo_id in self.locations:
+				self._remove(mongo_id)
+				self.version += 1
+
+	# must be called with the lock held
+	def _remove(self, mongo_id):
+		location = self.locations.pop(mongo_id, None)
+		if location is not None:
+			for level, value in zip(self.levels, location):
+				ids = level.get(value)
+				ids.discard(mongo_id)
+				if not ids:
+					del level[value]
+
+	# return the locations of the objects targeted by a group of targets ("All" matches any value)
+	def match(self, targets):
+		with self.lock:
+			sets = []
+			for level, key in zip(self.levels, TARGET_KEYS):
+				value = str(targets.get(key, "All"))
+				if value != "All":
+					sets.append(level.get(value, ()))
+			if not sets:
+				return list(self.locations.values())
+			sets.sort(key=len)
+			ids = set(sets[0]).intersection(*sets[1:])
+			return [self.locations[mongo_id] for mongo_id in ids]
+
+	def __len__(self):
+		return len(self.locations)
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+#
+# File: scenario_cache.py
+#
+# ### Description
+# In-process cache of the documents of the collection "scenarios", so that activating a scenario does not need a
+# round trip to MongoDB.
+#
+# ### Features
+# All the scenarios are loaded at startup. A background thread keeps the cache up to date (see collection_follower.py):
+# - with a MongoDB change stream when the server supports it (replica set), the inserted, replaced, updated and deleted
+#   scenarios are applied to the cache as soon as they are written (e.g. by add_scenarios.py)
+# - otherwise the hash of the collection (dbHash command) is polled and the whole cache is reloaded when it changes
+# A scenario which is not in the cache is read directly from MongoDB.
+#
+# Each cached scenario is stored alongside its compiled plan (see scenario_plan.py), so that the messages of a scenario
+# are built once when it is loaded instead of at each activation. A scenario which cannot be compiled (e.g. a target
+# without name, or fields which are not a dictionary) is logged and left out of the cache, as if it did not exist.
+#
+# ### Dependencies:
+# - pymongo (`sudo pip3 install pymongo`)
+#
+####################################################################################################
+
+import logging
+
+from collection_follower import CollectionFollower
+from scenario_plan import compile_scenario
+
+logger = logging.getLogger(__name__)
+
+
+class ScenarioCache(CollectionFollower):
+	def __init__(self, collection, poll_interval=5.0, compile=compile_scenario):
+		super().__init__(collection, "scenarios", poll_interval)
+		# function which turns a scenario document into a plan
+		self.compile = compile
+		# scenario_id -> scenario document
+		self.scenarios = {}
+		# scenario_id -> compiled plan of the scenario
+		self.plans = {}
+		# MongoDB _id -> scenario_id, to apply the deletions received from the change stream
+		self.ids = {}
+		self.hits = 0
+		self.misses = 0
+
+	# replace the content of the cache with all the scenarios of the collection
+	def reload(self):
+		scenarios = {}
+		plans = {}
+		ids = {}
+		for scenario in self.collection.find():
+			plan = self.safe_compile(scenario)
+			if plan is not None:
+				scenarios[scenario['scenario_id']] = scenario
+				plans[scenario['scenario_id']] = plan
+				ids[scenario['_id']] = scenario['scenario_id']
+		with self.lock:
+			self.scenarios = scenarios
+			self.plans = plans
+			self.ids = ids
+		logger.info("%d scenarios loaded in the cache", len(scenarios))
+
+	# return a scenario by scenario_id, read it from MongoDB on a cache miss
+	def get(self, scenario_id):
+		if self.lookup(scenario_id):
+			return self.scenarios.get(scenario_id)
+		return None
+
+	# return the compiled plan of a scenario by scenario_id, None if the scenario does not exist
+	def get_plan(self, scenario_id):
+		if self.lookup(scenario_id):
+			return self.plans.get(scenario_id)
+		return None
+
+	# return a scenario and its compiled plan, read together, (None, None) if the scenario does not exist
+	def get_with_plan(self, scenario_id):
+		if self.lookup(scenario_id):
+			with self.lock:
+				scenario = self.scenarios.get(scenario_id)
+				if scenario is not None:
+					return scenario, self.plans[scenario_id]
+		return None, None
+
+	# make sure that a scenario is in the cache. Return False if it does not exist.
+	def lookup(self, scenario_id):
+		with self.lock:
+			if scenario_id in self.scenarios:
+				self.hits += 1
+				return True
+			self.misses += 1
+		scenario = self.collection.find_one({'scenario_id': scenario_id})
+		if scenario:
+			return self.put(scenario)
+		return False
+
+	# return the plan of a scenario document, None if it has no scenario_id or cannot be compiled
+	def safe_compile(self, scenario):
+		if 'scenario_id' not in scenario:
+			return None
+		try:
+			return self.compile(scenario)
+		except Exception as e:
+			logger.error("Invalid scenario %s, ignored: %s: %s", scenario['scenario_id'], type(e).__name__, e)
+			return None
+
+	# add or replace a scenario in the cache. Return False if it is invalid.
+	def put(self, scenario):
+		plan = self.safe_compile(scenario)
+		if plan is None:
+			# An invalid new version must not leave the previous one in the cache
+			self.remove(scenario['_id'])
+			return False
+		with self.lock:
+			# The scenario_id of the document may have been changed
+			previous_id = self.ids.get(scenario['_id'])
+			if previous_id is not None and previous_id != scenario['scenario_id']:
+				self.scenarios.pop(previous_id, None)
+				self.plans.pop(previous_id, None)
+			self.scenarios[scenario['scenario_id']] = scenario
+			self.plans[scenario['scenario_id']] = plan
+			self.ids[scenario['_id']] = scenario['scenario_id']
+		return True
+
+	def remove(self, mongo_id):
+		with self.lock:
+			scenario_id = self.ids.pop(mongo_id, None)
+			if scenario_id is not None:
+				self.scenarios.pop(scenario_id, None)
+				self.plans.pop(scenario_id, None)
+
+	def stats(self):
+		with self.lock:
+			return {"size": len(self.scenarios), "hits": self.hits, "misses": self.misses}
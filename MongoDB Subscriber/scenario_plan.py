@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+#
+# File: scenario_plan.py
+#
+# ### Description
+# Compilation of a scenario document into a plan: the immutable list of the (topic, payload) MQTT messages to publish
+# when the scenario is activated.
+#
+# ### Features
+# The topics and the "config,key,value" / "field,key,value" payloads only depend on the scenario document, so they are
+# built once when the scenario is loaded in the cache. Activating a scenario is then a tight publish loop over the plan.
+#
+# Two payload formats are available:
+# - "bulk" (default): one message per group of targets, a JSON object with all the changes for these objects:
+#   {"config": {<key>: <value>, ...}, "fields": {<key>: <value>, ...}}. The objects apply it with a single database write.
+# - "legacy": one "config,<key>,<value>" or "field,<key>,<value>" message per key, for the objects which do not understand
+#   the bulk format.
+#
+# The plans above are broadcast: each group of targets gets one message on its group topic (e.g. All/All/All/Lamp/All),
+# which the broker delivers to the objects subscribed to it. resolve_scenario builds a plan from an index of the
+# registered objects instead (see object_index.py), and returns the number of objects targeted:
+# - "explicit": one message per targeted object, on its own topic. Any combination of "All" can be used, even the
+#   group topics that the objects do not subscribe to, and the groups without any object cost nothing.
+# - "broadcast": the group topics, as in the compiled plans.
+# - "auto": the group topic when the objects subscribe to it and it targets several objects (one message instead of
+#   one per object), the explicit topics otherwise.
+#
+####################################################################################################
+
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+PAYLOAD_FORMATS = ("bulk", "legacy")
+FAN_OUT_MODES = ("broadcast", "explicit", "auto")
+
+# groups of objects which the objects subscribe to (see DummyObject.get_subscription_topics):
+# for building, floor, room, type and name, True if the level is "All"
+SUBSCRIBED_GROUPS = frozenset([
+	(False, False, False, False, False),
+	(False, False, False, False, True),
+	(False, False, False, True, True),
+	(False, False, True, False, True),
+	(False, False, True, True, True),
+	(False, True, True, False, True),
+	(False, True, True, True, True),
+	(True, False, True, True, True),
+	(True, True, True, False, True),
+	(True, True, True, True, False),
+	(True, True, True, True, True)
+])
+
+
+# topic of the "change" messages for a group of objects
+def target_topic(building, level, room, type, name):
+	# The levels may be stored as numbers, e.g. "floor": 4
+	return "/".join(str(value) for value in (building, level, room, type, name)) + "/change"
+
+
+# payload of a bulk change
+def bulk_payload(config, fields):
+	changes = {}
+	if config:
+		changes['config'] = config
+	if fields:
+		changes['fields'] = fields
+	return json.dumps(changes, separators=(',', ':'))
+
+
+# payloads of the changes of a group of targets
+def group_payloads(obj, payload_format="bulk"):
+	if payload_format == "bulk":
+		if obj.get('config') or obj.get('fields'):
+			return [bulk_payload(obj.get('config'), obj.get('fields'))]
+		return []
+	payloads = []
+	if 'config' in obj.keys():
+		conf = obj['config']
+		for key in conf.keys():
+			payloads.append("config," + key + "," + str(conf[key]))
+	if 'fields' in obj.keys():
+		fields = obj['fields']
+		for key in fields.keys():
+			payloads.append("field," + key + "," + str(fields[key]))
+	return payloads
+
+
+# groups of targets of a scenario
+def scenario_groups(scenario):
+	if 'configs' not in scenario.keys():
+		logger.warning("no configs in scenario %s", scenario.get('scenario_id'))
+		return []
+	groups = []
+	for obj in scenario['configs']:
+		for key in ('targets', 'config', 'fields'):
+			if obj.get(key) is not None and not isinstance(obj[key], dict):
+				raise ValueError(key + " must be an object, not " + type(obj[key]).__name__)
+		if 'targets' in obj.keys():
+			groups.append(obj)
+		else:
+			logger.warning("no targets to publish in scenario %s", scenario.get('scenario_id'))
+	return groups
+
+
+# return the plan of a scenario: a tuple of (topic, payload)
+def compile_scenario(scenario, payload_format="bulk"):
+	plan = []
+	for obj in scenario_groups(scenario):
+		targets = obj['targets']
+		topic = target_topic(targets['building'], targets['floor'], targets['room'], targets['type'], targets['name'])
+		for payload in group_payloads(obj, payload_format):
+			plan.append((topic, payload))
+	return tuple(plan)
+
+
+# tell whether the objects subscribe to the group topic of some targets
+def is_subscribed_group(targets):
+	return tuple(str(targets[key]) == "All" for key in ('building', 'floor', 'room', 'type', 'name')) in SUBSCRIBED_GROUPS
+
+
+# return the number of objects of an index (see object_index.py) targeted by a scenario
+def count_targets(scenario, index):
+	targeted = set()
+	for obj in scenario_groups(scenario):
+		targeted.update(index.match(obj['targets']))
+	return len(targeted)
+
+
+# return the plan of a scenario for the objects of an index (see object_index.py), and the number of objects targeted
+def resolve_scenario(scenario, index, fan_out="auto", payload_format="bulk"):
+	plan = []
+	targeted = set()
+	for obj in scenario_groups(scenario):
+		targets = obj['targets']
+		locations = index.match(targets)
+		targeted.update(locations)
+		payloads = group_payloads(obj, payload_format)
+		if fan_out == "broadcast" or (fan_out == "auto" and len(locations) > 1 and is_subscribed_group(targets)):
+			topics = [target_topic(targets['building'], targets['floor'], targets['room'], targets['type'], targets['name'])]
+		else:
+			topics = [target_topic(*location) for location in locations]
+		for topic in topics:
+			for payload in payloads:
+				plan.append((topic, payload))
+	return tuple(plan), len(targeted)
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+#
+# File: scenario_publisher.py
+#
+# ### Description
+# Dedicated publisher for the fan-out of the scenarios to the objects.
+#
+# ### Features
+# The subscriber runs loop_forever and its on_message callback on the same thread, so the messages published from the
+# callback are only written to the socket when the callback returns. The ScenarioPublisher has its own MQTT connection
+# with its own network thread, and a fan-out thread which publishes the plans given by the subscriber: on_message only
+# hands the plan off and returns.
+#
+# The messages of a plan are pipelined: they are published without waiting for each acknowledgement, with at most
+# "window" messages in flight (not yet written for QoS 0, not yet acknowledged for QoS 1 and 2). The total fan-out
+# time of each scenario is logged.
+#
+# A message which is not written or acknowledged within "ack_timeout" seconds means that the connection is lost or
+# stalled: the fan-out of the plan stops, so the thread is not blocked forever, and the messages which were not
+# acknowledged and the ones which were not published are counted and logged. The messages with QoS 1 and 2 still
+# in flight are sent again by paho when it reconnects.
+#
+# ### Dependencies:
+# - paho.mqtt (`sudo pip3 install paho-mqtt`)
+#
+####################################################################################################
+
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from collections import deque
+
+from paho.mqtt.client import MQTT_ERR_SUCCESS
+
+# The shared modules are in the "common" directory at the root of the repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from cps2_config import mqtt_client, mqtt_connect
+
+logger = logging.getLogger(__name__)
+
+
+class ScenarioPublisher:
+	# connect to the broker of the settings (see common/cps2_config.py), or to the given one
+	def __init__(self, host=None, port=None, qos=0, window=1000, ack_timeout=10.0):
+		self.qos = qos
+		self.window = window
+		self.ack_timeout = ack_timeout
+		self.plans = queue.Queue()
+		self.lock = threading.Lock()
+		self.scenarios_published = 0
+		self.messages_published = 0
+		self.messages_failed = 0
+		self.messages_unacknowledged = 0
+		self.last_fan_out_time = 0.0
+
+		self.mqtt_client = mqtt_client()
+		# Let paho send as many messages as the window allows, and never refuse a message
+		self.mqtt_client.max_inflight_messages_set(window)
+		self.mqtt_client.max_queued_messages_set(0)
+		mqtt_connect(self.mqtt_client, host, port)
+		self.mqtt_client.loop_start()
+
+		self.thread = threading.Thread(target=self.run, name="scenario-publisher", daemon=True)
+		self.thread.start()
+
+	# hand a plan off to the fan-out thread
+	def submit(self, plan, scenario_id=None):
+		self.plans.put((plan, scenario_id))
+
+	# publish a single message
+	def publish(self, topic, payload):
+		return self.mqtt_client.publish(topic, payload, self.qos)
+
+	def run(self):
+		while True:
+			plan, scenario_id = self.plans.get()
+			try:
+				self.fan_out(plan, scenario_id)
+			except Exception as e:
+				logger.error("Unable to publish scenario %s: %s", scenario_id, e)
+
+	# publish all the messages of a plan with at most "window" messages in flight, return the fan-out time
+	def fan_out(self, plan, scenario_id=None):
+		start = time.monotonic()
+		in_flight = deque()
+		failed = 0
+		sent = 0
+		publish = self.mqtt_client.publish
+		qos = self.qos
+		stalled = False
+		for topic, payload in plan:
+			if len(in_flight) >= self.window:
+				in_flight[0].wait_for_publish(self.ack_timeout)
+				if not in_flight[0].is_published():
+					stalled = True
+					break
+				in_flight.popleft()
+			info = publish(topic, payload, qos)
+			sent += 1
+			if info.rc == MQTT_ERR_SUCCESS:
+				in_flight.append(info)
+			else:
+				failed += 1
+		# The fan-out is over when the last messages are written (QoS 0) or acknowledged (QoS 1 and 2)
+		while in_flight and not stalled:
+			in_flight[0].wait_for_publish(self.ack_timeout)
+			if not in_flight[0].is_published():
+				stalled = True
+				break
+			in_flight.popleft()
+		unacknowledged = sum(not info.is_published() for info in in_flight)
+		not_sent = len(plan) - sent
+		published = sent - failed - unacknowledged
+		duration = time.monotonic() - start
+
+		with self.lock:
+			self.scenarios_published += 1
+			self.messages_published += published
+			self.messages_failed += failed + not_sent
+			self.messages_unacknowledged += unacknowledged
+			self.last_fan_out_time = duration
+		if stalled:
+			logger.error("scenario %s: no acknowledgement for %.1f s, fan-out stopped: %d messages published, "
+						 "%d not acknowledged, %d not published", scenario_id, self.ack_timeout, published,
+						 unacknowledged, failed + not_sent)
+		else:
+			logger.info("scenario %s: %d messages published in %.1f ms (QoS %d)%s", scenario_id, published,
+						duration * 1000, qos, ", %d failed" % failed if failed else "")
+		return duration
+
+	def stats(self):
+		with self.lock:
+			return {
+				"scenarios_published": self.scenarios_published,
+				"messages_published": self.messages_published,
+				"messages_failed": self.messages_failed,
+				"messages_unacknowledged": self.messages_unacknowledged,
+				"last_fan_out_time": self.last_fan_out_time,
+				"pending_scenarios": self.plans.qsize()
+			}
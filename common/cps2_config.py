@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+#
+# File: cps2_config.py
+#
+# Description: connection settings shared by the subscribers, the objects and the database tools, and the factories
+# of their MongoDB, InfluxDB and MQTT clients.
+#
+# Features: the addresses, pool sizes, timeouts, write concern and keep-alive are set in one place instead of being
+# hard-coded in each program. The settings are read once, in this order (the last one wins):
+#   - the defaults below,
+#   - the JSON file given by the environment variable CPS2_CONFIG, e.g. {"mongodb": {"host": "db", "max_pool_size": 200}},
+#   - the environment variables CPS2_<SECTION>_<SETTING>, e.g. CPS2_MONGODB_HOST=db or CPS2_MQTT_KEEPALIVE=30.
+# The host and port given explicitly to a factory (e.g. the arguments of a dummy object) override the settings. A
+# program can also have its own default broker (e.g. the InfluxDB subscriber, which runs next to the broker and
+# connects to localhost), used when the host of the broker is not set by the file or the environment.
+#
+# The client libraries are imported by the factories, so a program only needs the libraries of the clients it uses.
+# influxdb_client() needs influxdb-python 5.0.0 or later (the pool_size argument does not exist in the 4.x releases).
+#
+####################################################################################################
+
+import copy
+import json
+import os
+
+# None: use the default of the client library
+DEFAULTS = {
+    "mongodb": {
+        "host": "192.168.43.48",
+        "port": 27017,
+        "max_pool_size": 100,
+        "min_pool_size": 0,
+        "connect_timeout_ms": 20000,
+        "server_selection_timeout_ms": 30000,
+        "socket_timeout_ms": None,
+        # write concern: number of acknowledgements ("majority" or a number), and journaling
+        "w": None,
+        "journal": None
+    },
+    "influxdb": {
+        "host": "localhost",
+        "port": 8086,
+        "username": "",
+        "password": "",
+        "database": "cps2_project",
+        # seconds
+        "timeout": None,
+        "retries": 3,
+        "pool_size": 10
+    },
+    "mqtt": {
+        "host": "192.168.43.48",
+        "port": 1883,
+        "keepalive": 60,
+        "max_inflight_messages": 20,
+        "max_queued_messages": 0,
+        # seconds between two reconnection attempts, doubled after each failure
+        "reconnect_delay_min": 1,
+        "reconnect_delay_max": 120
+    }
+}
+
+_config = None
+# (section, setting) set by the JSON file or the environment
+_configured = set()
+
+
+def parse_value(text, default):
+    """ convert the value of an environment variable to the type of the default value """
+    if isinstance(default, bool):
+        return text.lower() in ("1", "true", "yes", "on")
+    if isinstance(default, int):
+        return int(text)
+    if isinstance(default, float):
+        return float(text)
+    if default is None:
+        for convert in (int, float):
+            try:
+                return convert(text)
+            except ValueError:
+                pass
+        if text.lower() in ("true", "false"):
+            return text.lower() == "true"
+    return text
+
+
+def load_config(path=None, environ=os.environ, configured=None):
+    """ return the settings: the defaults, updated by the JSON file (path or $CPS2_CONFIG), then by the environment.
+    The (section, setting) which are not defaults are added to the set configured, if it is given.
+    """
+    config = copy.deepcopy(DEFAULTS)
+    configured = set() if configured is None else configured
+    path = path or environ.get("CPS2_CONFIG")
+    if path:
+        with open(path) as config_file:
+            for section, settings in json.load(config_file).items():
+                config.setdefault(section, {}).update(settings)
+                configured.update((section, name) for name in settings)
+    for section, settings in config.items():
+        for name, default in settings.items():
+            text = environ.get("CPS2_" + section.upper() + "_" + name.upper())
+            if text is not None:
+                settings[name] = parse_value(text, default)
+                configured.add((section, name))
+    return config
+
+
+def get_config(section):
+    """ return the settings of a section, read the first time they are needed """
+    global _config
+    if _config is None:
+        _config = load_config(configured=_configured)
+    return _config[section]
+
+
+def is_configured(section, name):
+    """ tell whether a setting is set by the JSON file or the environment, instead of being a default """
+    get_config(section)
+    return (section, name) in _configured
+
+
+def mongo_client(host=None, port=None):
+    """ return a MongoDB client with the pool size, timeouts and write concern of the settings """
+    from pymongo import MongoClient
+
+    settings = get_config("mongodb")
+    options = {
+        "maxPoolSize": settings["max_pool_size"],
+        "minPoolSize": settings["min_pool_size"],
+        "connectTimeoutMS": settings["connect_timeout_ms"],
+        "serverSelectionTimeoutMS": settings["server_selection_timeout_ms"],
+        "socketTimeoutMS": settings["socket_timeout_ms"],
+        "w": settings["w"],
+        "journal": settings["journal"]
+    }
+    return MongoClient(host or settings["host"], int(port or settings["port"]),
+                       **{name: value for name, value in options.items() if value is not None})
+
+
+def influxdb_client(host=None, port=None):
+    """ return an InfluxDB client with the pool size, timeout and retries of the settings """
+    from influxdb import InfluxDBClient
+
+    settings = get_config("influxdb")
+    return InfluxDBClient(host or settings["host"], int(port or settings["port"]), settings["username"],
+                          settings["password"], settings["database"], timeout=settings["timeout"],
+                          retries=settings["retries"], pool_size=settings["pool_size"])
+
+
+def mqtt_client(**kwargs):
+    """ return an MQTT client (not connected) with the in-flight window, queue and reconnection delays of the settings.
+    The keyword arguments are given to the paho Client (client_id, userdata, ...).
+    """
+    from paho.mqtt.client import Client
+
+    settings = get_config("mqtt")
+    client = Client(**kwargs)
+    client.max_inflight_messages_set(settings["max_inflight_messages"])
+    client.max_queued_messages_set(settings["max_queued_messages"])
+    client.reconnect_delay_set(settings["reconnect_delay_min"], settings["reconnect_delay_max"])
+    return client
+
+
+def mqtt_host(default_host=None):
+    """ return the host of the broker: the one of the settings, or default_host if it is given and the host is not
+    set by the file or the environment
+    """
+    if default_host is not None and not is_configured("mqtt", "host"):
+        return default_host
+    return get_config("mqtt")["host"]
+
+
+def mqtt_connect(client, host=None, port=None, default_host=None):
+    """ connect an MQTT client to the broker of the settings (or the given one) with the keep-alive of the settings.
+    default_host replaces the default host of the settings (see mqtt_host).
+    """
+    settings = get_config("mqtt")
+    return client.connect(host or mqtt_host(default_host), int(port or settings["port"]), settings["keepalive"])
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+#
+# File: cps2_logging.py
+#
+# Description: Logging shared by the subscribers and the objects.
+#
+# Features: the records are put in a queue and written to the console by a background thread, so that logging never
+# blocks the thread which receives the MQTT messages. The lines which would be logged for every message go through a
+# SampledLogger that only emits 1 record out of N, and a ThroughputReporter periodically logs a summary of the number
+# of messages processed.
+#
+# The level and the sampling rate are read from the environment variables CPS2_LOG_LEVEL (default: INFO) and
+# CPS2_LOG_SAMPLE (default: 100) unless they are given to setup_logging. Per-message lines are logged at the DEBUG
+# level, so they are not even formatted with the default settings.
+#
+####################################################################################################
+
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+_listener = None
+_sample_rate = int(os.environ.get("CPS2_LOG_SAMPLE", 100))
+
+
+def setup_logging(level=None, sample_rate=None):
+    """ send the records of all the loggers to the console through a queue. Can be called only once per process. """
+    global _listener, _sample_rate
+    if _listener is not None:
+        return
+    if sample_rate is not None:
+        _sample_rate = max(1, int(sample_rate))
+
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    log_queue = queue.Queue(-1)
+    root = logging.getLogger()
+    root.setLevel(level or os.environ.get("CPS2_LOG_LEVEL", "INFO"))
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+
+    _listener = logging.handlers.QueueListener(log_queue, console, respect_handler_level=True)
+    _listener.start()
+    # Write the remaining records before exiting
+    atexit.register(_listener.stop)
+
+
+class SampledLogger:
+    """ logger for per-message lines: only 1 call out of sample_rate is logged """
+
+    def __init__(self, logger, sample_rate=None):
+        self.logger = logger
+        self.sample_rate = sample_rate
+        self.calls = 0
+
+    def log(self, level, msg, *args):
+        # The arguments are only formatted if the record is emitted
+        if not self.logger.isEnabledFor(level):
+            return
+        self.calls += 1
+        rate = self.sample_rate or _sample_rate
+        if self.calls % rate == 0 or rate == 1:
+            self.logger.log(level, msg, *args)
+
+    def debug(self, msg, *args):
+        self.log(logging.DEBUG, msg, *args)
+
+    def info(self, msg, *args):
+        self.log(logging.INFO, msg, *args)
+
+
+class ThroughputReporter:
+    """ count the processed messages and log the throughput periodically """
+
+    def __init__(self, logger, what="messages", interval=60.0):
+        self.logger = logger
+        self.what = what
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.total = 0
+        self.thread = None
+
+    def count(self, n=1):
+        with self.lock:
+            self.total += n
+
+    def start(self):
+        """ start the periodic report, if it is not already started """
+        with self.lock:
+            if self.thread is not None or self.interval <= 0:
+                return self
+            self.thread = threading.Thread(target=self._run, name="throughput-reporter", daemon=True)
+            self.thread.start()
+            return self
+
+    def _run(self):
+        last_total = 0
+        last_time = time.monotonic()
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                total = self.total
+            now = time.monotonic()
+            self.logger.info("%d %s in the last %.1f s (%.1f/s), %d in total", total - last_total, self.what,
+                             now - last_time, (total - last_total) / (now - last_time), total)
+            last_total = total
+            last_time = now
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+#
+# File: cps2_schema.py
+#
+# Description: indexes required on the collections of the database "cps2_project" in MongoDB.
+#
+# Features: the scenarios are fetched by scenario_id, and the objects are identified and looked up by their location
+# (building, floor, room, type and name) or their type. Without these indexes every query is a collection scan.
+# create_indexes() creates the missing ones (used by "DB utils/bootstrap_schema.py" and by the objects at startup),
+# missing_indexes() tells which ones do not exist (checked by the MongoDB subscriber at startup). An existing index
+# is recognized by its keys and uniqueness, whatever its name.
+#
+# Dependencies:
+#   - pymongo (sudo pip3 install pymongo)
+#
+####################################################################################################
+
+from pymongo import ASCENDING
+from pymongo.errors import PyMongoError
+
+DATABASE = "cps2_project"
+
+LOCATION_FIELDS = ("building", "floor", "room", "object_type", "object_name")
+
+# collection -> list of (index name, keys, unique)
+INDEXES = {
+    "objects": [
+        # Natural key of the objects: one object per location
+        ("location", [(field + ".value", ASCENDING) for field in LOCATION_FIELDS], True),
+        ("object_type", [("object_type.value", ASCENDING)], False)
+    ],
+    "scenarios": [
+        ("scenario_id", [("scenario_id", ASCENDING)], True)
+    ]
+}
+
+
+def has_index(collection, keys, unique):
+    """ tell whether a collection has an index on these keys (a unique one if unique is True) """
+    for index in collection.index_information().values():
+        if [tuple(key) for key in index["key"]] == keys and (index.get("unique", False) or not unique):
+            return True
+    return False
+
+
+def missing_indexes(database, collections=None):
+    """ return the (collection, index name) of the required indexes which do not exist,
+    for all the collections or the given ones
+    """
+    missing = []
+    for collection_name, indexes in INDEXES.items():
+        if collections is not None and collection_name not in collections:
+            continue
+        for name, keys, unique in indexes:
+            if not has_index(database[collection_name], keys, unique):
+                missing.append((collection_name, name))
+    return missing
+
+
+def create_indexes(database, collections=None):
+    """ create the required indexes which do not exist, for all the collections or the given ones.
+    Return the (collection, index name, error) of the indexes which could not be created
+    (e.g. a unique index on a collection with duplicates).
+    """
+    errors = []
+    for collection_name, name in missing_indexes(database, collections):
+        for index_name, keys, unique in INDEXES[collection_name]:
+            if index_name != name:
+                continue
+            try:
+                database[collection_name].create_index(keys, unique=unique, name=name)
+            except PyMongoError as e:
+                errors.append((collection_name, name, e))
+    return errors
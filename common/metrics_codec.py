@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+#
+# File: metrics_codec.py
+#
+# Description: payload of the batched metrics, shared by the objects (publishers) and the InfluxDB subscriber.
+#
+# Features: with the "batched" publishing format, an object publishes all the fields of a sample in a single message
+# on the topic <building>/<floor>/<room>/<object_type>/<object_name>/batch/metrics, instead of one message per field
+# on .../metrics/<field_name>. The batched topics have one level more than the base topic of the object, so they do
+# not match its <base_topic>/+ subscription and the broker does not send the batches back to their publisher.
+# The payload is a compact JSON object:
+#   {"t": <timestamp>, "f": {"<field_name>": <value>, ...}}
+# where the timestamp of the sample, an integer number of nanoseconds since the epoch, is optional.
+# The values are JSON numbers or strings. When decoding, they are normalized like the per-field messages: a number,
+# or a string which can be read as a number, becomes a float, anything else is kept as a string.
+#
+# With the "binary" publishing format, the same sample is published on .../batch/metrics.bin in a struct-packed payload:
+#   - 1 byte of flags: 0x01 if a timestamp follows
+#   - the timestamp, if any: signed 64-bit integer, nanoseconds since the epoch
+#   - for each field: the length of the name (1 byte), the name (UTF-8), a type tag and the value:
+#     "d" and a 64-bit float, or "s", the length of the string (2 bytes) and the string (UTF-8)
+# All the integers are big endian. The values are normalized when they are encoded, so the subscriber reads the type
+# from the tag instead of trying to parse every value as a number.
+#
+# In a batched point, each metric name is an InfluxDB field, whose type is set by its first value. The placeholder of a
+# field which has not been set yet ("No value") and nan or the infinities would conflict with the numbers written later,
+# and reject the whole batch, so storable_fields() leaves them out.
+#
+####################################################################################################
+
+import json
+import math
+import struct
+
+# level of the topics of the batched metrics after the base topic of the object
+BATCH_LEVEL = "batch"
+# levels of the topic of the batched metrics, and of the binary metrics, after the base topic of the object
+BATCH_CHANNEL = BATCH_LEVEL + "/metrics"
+BINARY_CHANNEL = BATCH_LEVEL + "/metrics.bin"
+
+PUBLISHING_FORMATS = ("per-field", "batched", "binary")
+
+# value of a field which has not been set yet
+PLACEHOLDER = "No value"
+
+FLAG_TIMESTAMP = 0x01
+TAG_DOUBLE = ord("d")
+TAG_STRING = ord("s")
+_TIMESTAMP = struct.Struct(">q")
+_DOUBLE = struct.Struct(">d")
+_LENGTH = struct.Struct(">H")
+
+
+def encode_fields(fields, timestamp=None):
+    """ return the batched payload of a sample: a dictionary {field_name: value},
+    with an optional timestamp in nanoseconds since the epoch
+    """
+    message = {"f": fields} if timestamp is None else {"t": timestamp, "f": fields}
+    return json.dumps(message, separators=(",", ":"), default=str)
+
+
+def decode_fields(payload):
+    """ return the fields {field_name: float or string} and the timestamp (None if absent) of a batched payload,
+    (None, None) if it is invalid
+    """
+    try:
+        message = json.loads(payload.decode("utf-8") if isinstance(payload, bytes) else payload)
+    except ValueError:
+        return None, None
+    if not isinstance(message, dict) or not isinstance(message.get("f"), dict):
+        return None, None
+    timestamp = message.get("t")
+    if not isinstance(timestamp, int) or isinstance(timestamp, bool):
+        timestamp = None
+    return {str(name): field_value(value) for name, value in message["f"].items()}, timestamp
+
+
+def field_value(value):
+    """ normalize a value: a float if possible, a string otherwise """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    value = str(value)
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+def storable_fields(fields):
+    """ return the fields of a batched point without the placeholders and the non-finite numbers,
+    and the number of values left out
+    """
+    kept = {name: value for name, value in fields.items()
+            if value != PLACEHOLDER and not (isinstance(value, float) and not math.isfinite(value))}
+    return kept, len(fields) - len(kept)
+
+
+def encode_binary(fields, timestamp=None):
+    """ return the binary payload of a sample, with an optional timestamp in nanoseconds since the epoch """
+    parts = [bytes([FLAG_TIMESTAMP if timestamp is not None else 0])]
+    if timestamp is not None:
+        parts.append(_TIMESTAMP.pack(timestamp))
+    for name, value in fields.items():
+        name = str(name).encode("utf-8")
+        if len(name) > 255:
+            raise ValueError("Field name too long for the binary format: " + name.decode("utf-8"))
+        parts.append(bytes([len(name)]))
+        parts.append(name)
+        value = field_value(value)
+        if isinstance(value, float):
+            parts.append(b"d")
+            parts.append(_DOUBLE.pack(value))
+        else:
+            value = value.encode("utf-8")
+            if len(value) > 65535:
+                raise ValueError("Value of " + name.decode("utf-8") + " too long for the binary format")
+            parts.append(b"s")
+            parts.append(_LENGTH.pack(len(value)))
+            parts.append(value)
+    return b"".join(parts)
+
+
+def decode_binary(payload):
+    """ return the fields {field_name: float or string} and the timestamp (None if absent) of a binary payload,
+    (None, None) if it is invalid
+    """
+    try:
+        offset = 1
+        timestamp = None
+        if payload[0] & FLAG_TIMESTAMP:
+            timestamp = _TIMESTAMP.unpack_from(payload, 1)[0]
+            offset = 9
+        fields = {}
+        end = len(payload)
+        while offset < end:
+            length = payload[offset]
+            name = payload[offset + 1:offset + 1 + length].decode("utf-8")
+            offset += 1 + length
+            tag = payload[offset]
+            if tag == TAG_DOUBLE:
+                fields[name] = _DOUBLE.unpack_from(payload, offset + 1)[0]
+                offset += 9
+            elif tag == TAG_STRING:
+                length = _LENGTH.unpack_from(payload, offset + 1)[0]
+                fields[name] = payload[offset + 3:offset + 3 + length].decode("utf-8")
+                offset += 3 + length
+            else:
+                return None, None
+        # A truncated string would end after the payload
+        if offset != end:
+            return None, None
+        return fields, timestamp
+    except (IndexError, struct.error, UnicodeDecodeError):
+        return None, None
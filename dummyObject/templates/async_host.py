@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+#
+# File: async_host.py
+#
+# Description: asyncio runtime for the dummy objects: a whole fleet of objects runs on a single event loop.
+#
+# Features: same fleet and message dispatching as simulator_host.py, but nothing blocks the message loop:
+#   - the shared MQTT client is driven by the event loop (its socket is watched with add_reader / add_writer)
+#     instead of a network thread,
+#   - the response latency of the objects is a timer of the event loop (loop.call_later), so a request waiting for
+#     its answer does not delay the other messages,
+#   - the scheduler of the host (see scheduler.py) runs as a task of the event loop,
+#   - the blocking operations are run in the default executor, never on the event loop: the creation of the host
+#     (which checks the indexes of MongoDB), the connection and the reconnections to the broker, the creation of the
+#     objects and the final flush. The other MongoDB writes are done by the background thread of the
+#     write-coalescing layer.
+#
+# Usage: python3 async_host.py <fleet.json> [--jitter <fraction of the period>] [--routing single|building|broker]
+#
+# Dependencies:
+#   - paho-mqtt (sudo pip3 install paho-mqtt)
+#   - pymongo (sudo pip3 install pymongo)
+#
+####################################################################################################
+
+import asyncio
+import json
+import logging
+
+from paho.mqtt.client import MQTT_ERR_SUCCESS
+
+from dummyObject import setup_logging
+# dummyObject adds the "common" directory to the module search path
+from cps2_config import mqtt_connect
+from simulator_host import SimulatorHost, create_fleet, parse_arguments
+
+logger = logging.getLogger("async_host")
+
+
+class AsyncSimulatorHost(SimulatorHost):
+    """ run the objects of a simulator host on an asyncio event loop """
+
+    def __init__(self, loop, mongodb_host, mongodb_port, broker_url, jitter=0.0, routing="single"):
+        """ connect to MongoDB. Blocks: must be run in an executor, then start() connects to the broker. """
+        self.loop = loop
+        self.socket = None
+        self.broker_url = None
+        super().__init__(mongodb_host, mongodb_port, broker_url, jitter, routing)
+
+    def connect(self, broker_url):
+        """ let the event loop drive the shared MQTT client. The connection is made by start(). """
+        client = self.mqtt_client
+        client.on_socket_open = self.on_socket_open
+        client.on_socket_close = self.on_socket_close
+        client.on_socket_register_write = self.on_socket_register_write
+        client.on_socket_unregister_write = self.on_socket_unregister_write
+        self.broker_url = broker_url
+
+    async def start(self):
+        """ connect to the MQTT broker without blocking the event loop """
+        await self.loop.run_in_executor(None, mqtt_connect, self.mqtt_client, self.broker_url)
+        self.misc_task = self.loop.create_task(self.misc_loop())
+
+    def on_socket_open(self, client, userdata, sock):
+        """ read the incoming packets when the socket is readable. Called from the executor. """
+        self.socket = sock
+        self.loop.call_soon_threadsafe(self.loop.add_reader, sock, client.loop_read)
+
+    def on_socket_close(self, client, userdata, sock):
+        """ stop watching a closed socket """
+        self.socket = None
+        if self.loop.is_closed():
+            # The client is collected after the end of the event loop
+            return
+        self.loop.call_soon_threadsafe(self.loop.remove_reader, sock)
+        self.loop.call_soon_threadsafe(self.loop.remove_writer, sock)
+
+    def on_socket_register_write(self, client, userdata, sock):
+        """ write the outgoing packets when the socket is writable. May be called from another thread. """
+        self.loop.call_soon_threadsafe(self.loop.add_writer, sock, client.loop_write)
+
+    def on_socket_unregister_write(self, client, userdata, sock):
+        """ stop watching the socket once all the packets are written """
+        self.loop.remove_writer(sock)
+
+    async def misc_loop(self):
+        """ keep the connection alive and reconnect when it is lost """
+        while True:
+            if self.mqtt_client.loop_misc() != MQTT_ERR_SUCCESS and self.socket is None:
+                try:
+                    await self.loop.run_in_executor(None, self.mqtt_client.reconnect)
+                except OSError as e:
+                    logger.error("Unable to reconnect to the MQTT broker: %s", e)
+            await asyncio.sleep(1)
+
+    def call_later(self, delay, function):
+        """ call a function after a delay in seconds, on the event loop """
+        self.loop.call_soon_threadsafe(self.loop.call_later, delay, function)
+
+    async def run(self):
+        """ publish the fields of all the objects forever """
+        await self.scheduler.run_async()
+
+
+async def main(fleet, jitter, routing):
+    """ create the fleet and run it """
+    loop = asyncio.get_event_loop()
+    host = await loop.run_in_executor(None, AsyncSimulatorHost, loop, fleet.get("mongodb_host"),
+                                      fleet.get("mongodb_port"), fleet.get("broker_url"), jitter, routing)
+    await host.start()
+    start = loop.time()
+    # The objects insert their description in MongoDB when they are created
+    await loop.run_in_executor(None, create_fleet, host, fleet)
+    logger.info("%d objects created in %.1f s, %d subscriptions to the broker", len(host.objects),
+                loop.time() - start, host.count_subscriptions())
+    try:
+        await host.run()
+    finally:
+        await loop.run_in_executor(None, host.mongo_writer.flush)
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+
+    setup_logging()
+    with open(args.fleet) as fleet_file:
+        fleet = json.load(fleet_file)
+
+    try:
+        asyncio.run(main(fleet, args.jitter, args.routing))
+    except KeyboardInterrupt:
+        pass
@@ -8,6 +8,47 @@
 # Features: manage basic behaviour such as answers to requests from MQTT messages,
 # configuration parameters read / write, and write operations in MongoDB.
 #
+# Messages: the "change" messages are either "<config/field>,<name>,<new_value>" or a bulk change, a JSON object
+# {"config": {<name>: <new_value>, ...}, "fields": {<name>: <new_value>, ...}} applied with a single write in MongoDB.
+# The "request" messages are "<config/field>,<name>,<client_id>" and the answer is published on <base_topic>/answer/<client_id>.
+# The response latency is simulated by scheduling the answer (see defer()), so the object keeps processing the other
+# messages while a request is waiting.
+#
+# Fields: the value of a field is either set by the system or given by a function. A function field can be declared
+# with a ttl (add_field): its value is then sampled at most once per ttl seconds and shared by the requests and the
+# periodic publications in the meantime. sampling_stats() counts the samples taken and the ones saved by the cache.
+#
+# Metrics: with the configuration parameter publishing_format set to "per-field" (default), each field is published in
+# its own message on <base_topic>/metrics/<field_name>. With "batched", all the fields of a sample are published in a
+# single message on <base_topic>/batch/metrics (see common/metrics_codec.py), which the InfluxDB subscriber writes as
+# a single point. "binary" publishes the same sample in a compact binary payload on <base_topic>/batch/metrics.bin.
+# These topics do not match the subscriptions of the object, so the broker does not send the batches back to it.
+# With the configuration parameter timestamp_source set to "object", the batched and binary payloads carry the time at
+# which the sample was taken, used by the InfluxDB subscriber instead of the receive time.
+#
+# Runtime state: the object does not keep its description document. Its topics, configuration parameters and fields
+# are kept in a compact state with __slots__ (see object_state.py), so a request or a publication reads flat
+# attributes instead of walking the nested description, and a large fleet fits in less memory.
+#
+# MongoDB: the description is upserted when the object is created, with the base topic as _id, so restarting an
+# object updates its document (its creation date is kept). The registration and the following updates
+# (set_parameter_value, add_field, ...) go through a write-coalescing layer (see mongo_writer.py): they are merged and
+# written in the background after a short debounce window, so the creation of an object costs a single write.
+# Call flush() to write them now.
+#
+# Publications: in continuous mode, the fields are published by a scheduler (see scheduler.py) at each boundary of the
+# publishing period. An object in on-demand mode has no publication job and costs nothing until it is requested.
+# Changing publishing_mode or publishing_period replaces the job at once: the object publishes immediately and then
+# at the new period, instead of waiting for the end of the current period.
+#
+# Connections: a standalone object connects to the MongoDB server and the broker given to its constructor, with the
+# pool size, timeouts and keep-alive of the shared settings (see common/cps2_config.py). The objects of a simulator host
+# use the clients of the host.
+#
+# Logging: the logs go through the queued logging of common/cps2_logging.py. The lines written for each received
+# message are logged at the DEBUG level and sampled, and the number of received messages is summarized periodically.
+# Set CPS2_LOG_LEVEL=DEBUG to see them.
+#
 # Dependencies:
 # 	- paho-mqtt (sudo pip3 install paho-mqtt)
 #   - pymongo (sudo pip3 install pymongo)
@@ -15,21 +56,43 @@
 ####################################################################################################
 
 import json
+import logging
+import os
 import sys
+import threading
 from datetime import datetime
-from time import sleep
+from time import monotonic, sleep, time_ns
 from abc import ABCMeta, abstractmethod
 
-from paho.mqtt.client import Client
-from pymongo import MongoClient
+# The shared modules are in the "common" directory at the root of the repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "common"))
+from cps2_config import get_config, mongo_client, mqtt_client, mqtt_connect
+from cps2_logging import SampledLogger, ThroughputReporter, setup_logging
+from metrics_codec import BATCH_CHANNEL, BINARY_CHANNEL, PUBLISHING_FORMATS, encode_binary, encode_fields
+from mongo_writer import CoalescingWriter, ensure_object_indexes
+from object_state import ObjectState
+from scheduler import PublishScheduler
+
+logger = logging.getLogger("dummyObject")
+# The lines logged for every message are sampled, the number of messages is summarized periodically
+message_log = SampledLogger(logger)
+throughput = ThroughputReporter(logger, "received messages")
 
 
 class DummyObject:
     """ simulate an object with its configuration and sensors """
     __metaclass__ = ABCMeta
 
-    def __init__(self, building, floor, room, object_type, object_name, mongodb_host, mongodb_port, broker_url):
-        """ initialize the object """
+    def __init__(self, building, floor, room, object_type, object_name, mongodb_host, mongodb_port, broker_url,
+                 host=None):
+        """ initialize the object.
+        If a simulator host is given, the object uses the connections of the host and is driven by its scheduler
+        (see simulator_host.py), otherwise it has its own MongoDB and MQTT clients.
+        """
+        self.host = host
+        # Scheduler publishing the fields and its publication job, which only exists in continuous mode
+        self.scheduler = None
+        self.publish_job = None
 
         # The following variable contains all the information about the object with
         # its location, configuration and the metrics it can collect.
@@ -40,7 +103,10 @@ class DummyObject:
         #
         # The configuration parameters also have the list of possible values
         # to enable a client to send valid values if they want to change them.
-        self.description = {
+        #
+        # The description is only kept until it is inserted in MongoDB: the object reads and updates its flat
+        # runtime state (see object_state.py), and the changes are written in both.
+        description = {
             "building": {
                 "label": "Building",
                 "description": "The building where the object is located",
@@ -90,6 +156,22 @@ class DummyObject:
                         "possible_values": "positive",
                         "value": 2000
                     },
+                    "publishing_format": {
+                        "label": "Publishing format",
+                        "description": "How the fields are published: one message per field, or all the fields "
+                                       "of a sample in a single message",
+                        "type": "String",
+                        "possible_values": list(PUBLISHING_FORMATS),
+                        "value": "per-field"
+                    },
+                    "timestamp_source": {
+                        "label": "Timestamp source",
+                        "description": "Who timestamps the published samples: the subscriber when it receives them, "
+                                       "or the object when it takes them (batched and binary formats only)",
+                        "type": "String",
+                        "possible_values": ["subscriber", "object"],
+                        "value": "subscriber"
+                    },
                     "response_latency": {
                         "label": "Response latency",
                         "description": "The delay in milliseconds between the reception of a request "
@@ -121,40 +203,46 @@ class DummyObject:
             }
         }
 
-        # Container for the values of the fields (either functions or static values)
-        # Should be filled by the "add_field" function called in the children classes
-        self.fields = {}
-
-        # Base parameters such as the location and the type of the object
-        self.base_parameters = {
-            "building": self.description["building"]["value"],
-            "floor": self.description["floor"]["value"],
-            "room": self.description["room"]["value"],
-            "object_type": self.description["object_type"]["value"],
-            "object_name": self.description["object_name"]["value"]
-        }
+        # Runtime state: location and topics, configuration parameters, and the fields (either functions or static
+        # values), which should be filled by the "add_field" function called in the children classes
+        self.state = ObjectState((building, floor, room, object_type, object_name),
+                                 {name: parameter["value"] for name, parameter in
+                                  description["config"]["values"].items()},
+                                 BATCH_CHANNEL, BINARY_CHANNEL)
+        # Calls to the functions of the fields, and calls saved by their ttl
+        self.samples_taken = 0
+        self.samples_saved = 0
 
         # Base topic for the MQTT messages
-        self.base_topic = "/".join(self.base_parameters.values())
+        self.base_topic = self.state.base_topic
 
-        print("")
-        print("### Object information ###")
-        print("(Should be sent to MongoDB)")
-        print(json.dumps(self.description, indent=2))
+        logger.info("### Object information: %s ###", self.base_topic)
+        logger.debug("(Should be sent to MongoDB)\n%s", json.dumps(description, indent=2))
 
         # Persist the object description in MongoDB
-        print("Connecting to MongoDB.")
-        self.mongo_client = MongoClient("192.168.43.48")
-        print("Persisting the object description in the collection \"objects\" of the database "
-              "\"cps2_project\" in MongoDB.")
-        self.mongo_id = self.mongo_client\
-            .cps2_project\
-            .objects\
-            .insert_one(self.description)\
-            .inserted_id
+        if host is None:
+            logger.info("Connecting to MongoDB.")
+            self.mongo_client = mongo_client(mongodb_host, mongodb_port)
+            ensure_object_indexes(self.mongo_client.cps2_project.objects)
+            # The registration and the following updates are coalesced and written in the background
+            self.mongo_writer = CoalescingWriter(self.mongo_client.cps2_project.objects)
+        else:
+            self.mongo_client = host.mongo_client
+            self.mongo_writer = host.mongo_writer
+        logger.debug("Persisting the object description in the collection \"objects\" of the database "
+                     "\"cps2_project\" in MongoDB.")
+        # The base topic identifies the object: restarting it updates its document instead of inserting a new one
+        self.mongo_id = self.base_topic
+        creation_date = description.pop("creation_date")
+        self.mongo_writer.register(self.mongo_id, description, {"creation_date": creation_date})
 
         # Initialize the MQTT client
-        self.init_mqtt_client(broker_url)
+        if host is None:
+            self.init_mqtt_client(broker_url)
+        else:
+            self.mqtt_client = host.mqtt_client
+            host.register(self)
+        throughput.start()
 
     @abstractmethod
     def custom_mqtt_reaction(self, topic, message):
@@ -167,164 +255,273 @@ class DummyObject:
         """ initialize the MQTT client with the topics to subscribe to
         and the function to manage the received messages
         """
-        self.mqtt_client = Client()  # create client object
-        print("Connecting to the MQTT broker", host, ".")
-        self.mqtt_client.connect(host)
+        self.mqtt_client = mqtt_client()  # create client object
+        logger.info("Connecting to the MQTT broker %s.", host or get_config("mqtt")["host"])
+        mqtt_connect(self.mqtt_client, host)
 
         def on_message(client, userdata, msg):
             """ callback function to process mqtt messages """
-            message_type = msg.topic.split("/")[-1]
-            message = str(msg.payload.decode("utf-8"))
-            print("\nreceived message on topic " + msg.topic + ": " + message)
-
-            # The message should contain 3 things:
-            # either <field/config>, parameter_name, new_value
-            # or <field/config>, parameter_name, client_id
-            if len(message.split(",")) != 3:
-                print("Bad message structure")
-                return 0
-
-            # React to custom topics. Should be implemented in a concrete class depending on the behaviour to simulate.
-            self.custom_mqtt_reaction(msg.topic, message)
-
-            # The client wants to change the value of a parameter
-            if message_type == "change":
-                request_type, parameter_name, new_value = message.split(",")
-                if request_type == "config" and parameter_name in self.get_parameters_list():
-                    self.set_parameter_value(parameter_name, new_value)
-                elif request_type == "field" and parameter_name in self.get_fields_list():
-                    self.set_field_value(parameter_name, new_value)
-
-            # The client requests the value of a parameter
-            elif message_type == "request":
-                    request_type, parameter_name, client_id = message.split(",")
-
-                    # Fake latency
-                    sleep(float(self.get_parameter_value("response_latency")) / 1000)
-
-                    # ask for a configuration parameter
-                    if request_type == "config":
-                        print("request for a configuration parameter")
-                        if parameter_name in self.get_parameters_list():
-                            self.mqtt_client.publish(self.base_topic + "/answer/" + client_id,
-                                                     self.get_parameter_value(parameter_name))
-                        else:
-                            self.mqtt_client.publish(self.base_topic + "/answer/" + client_id,
-                                                     "no such parameter")
-
-                    # ask for a field
-                    elif request_type == "field":
-                        print("request for a field")
-                        if parameter_name in self.get_fields_list():
-                            client.publish(self.base_topic + "/answer/" + client_id,
-                                           self.get_field_value(parameter_name))
-                        else:
-                            self.mqtt_client.publish(self.base_topic + "/answer/" + client_id,
-                                                     "no such field")
+            self.on_message(msg.topic, msg.payload)
 
         self.mqtt_client.on_message = on_message  # bind function to callback
 
-        building, floor, room, type, name = self.base_parameters.values()
-
-        topics = [
-            building + "/" + floor + "/" + room + "/" + type + "/" + name + "/+",
-            building + "/" + floor + "/" + room + "/" + type + "/All/+",
-            building + "/" + floor + "/" + room + "/All/All/+",
-            building + "/" + floor + "/All/" + type + "/All/+",
-            building + "/" + floor + "/All/All/All/+",
-            building + "/All/All/" + type + "/All/+",
-            building + "/All/All/All/All/+",
-            "All/" + floor + "All/All/All",
-            "All/All/All/" + type + "/All/+",
-            "All/All/All/All/" + name + "/+",
-            "All/All/All/All/All/+"
-        ]
-        for topic in topics:
-            print("Subscribing to the topic " + topic)
+        for topic in self.get_subscription_topics():
+            logger.info("Subscribing to the topic %s", topic)
             self.mqtt_client.subscribe(topic)
 
         self.mqtt_client.loop_start()  # start loop to process received messages
 
+    def get_subscription_topics(self):
+        """ return the topics on which the object receives its messages """
+        return list(self.state.subscription_topics)
+
+    def on_message(self, topic, payload):
+        """ process a mqtt message received on one of the subscription topics """
+        message_type = topic.split("/")[-1]
+        message = str(payload.decode("utf-8"))
+        message_log.debug("received message on topic %s: %s", topic, message)
+        throughput.count()
+
+        # Bulk change: a JSON object with several configuration parameters and/or fields, applied at once
+        # {"config": {<parameter_name>: <new_value>, ...}, "fields": {<field_name>: <new_value>, ...}}
+        if message_type == "change" and message.startswith("{"):
+            try:
+                changes = json.loads(message)
+            except ValueError:
+                changes = None
+            if not isinstance(changes, dict) or not all(isinstance(changes.get(key), (dict, type(None)))
+                                                         for key in ("config", "fields")):
+                message_log.debug("Bad message structure")
+                return 0
+            self.custom_mqtt_reaction(topic, message)
+            self.apply_changes(changes.get("config"), changes.get("fields"))
+            return 0
+
+        # The message should contain 3 things:
+        # either <field/config>, parameter_name, new_value
+        # or <field/config>, parameter_name, client_id
+        if len(message.split(",")) != 3:
+            message_log.debug("Bad message structure")
+            return 0
+
+        # React to custom topics. Should be implemented in a concrete class depending on the behaviour to simulate.
+        self.custom_mqtt_reaction(topic, message)
+
+        # The client wants to change the value of a parameter
+        if message_type == "change":
+            request_type, parameter_name, new_value = message.split(",")
+            if request_type == "config" and parameter_name in self.get_parameters_list():
+                self.set_parameter_value(parameter_name, new_value)
+            elif request_type == "field" and parameter_name in self.get_fields_list():
+                self.set_field_value(parameter_name, new_value)
+
+        # The client requests the value of a parameter
+        elif message_type == "request":
+            request_type, parameter_name, client_id = message.split(",")
+
+            # Fake latency: the answer is scheduled, so the other messages are processed in the meantime
+            self.defer(self.state.response_latency,
+                       lambda: self.answer_request(request_type, parameter_name, client_id))
+
+    def answer_request(self, request_type, parameter_name, client_id):
+        """ publish the answer to a request on <base_topic>/answer/<client_id> """
+        # ask for a configuration parameter
+        if request_type == "config":
+            message_log.debug("request for a configuration parameter")
+            if parameter_name in self.state.parameters:
+                self.mqtt_client.publish(self.state.answer_prefix + client_id,
+                                         self.state.parameters[parameter_name])
+            else:
+                self.mqtt_client.publish(self.state.answer_prefix + client_id,
+                                         "no such parameter")
+
+        # ask for a field
+        elif request_type == "field":
+            message_log.debug("request for a field")
+            if parameter_name in self.state.fields:
+                self.mqtt_client.publish(self.state.answer_prefix + client_id,
+                                         self.get_field_value(parameter_name))
+            else:
+                self.mqtt_client.publish(self.state.answer_prefix + client_id,
+                                         "no such field")
+
+    def defer(self, delay, function):
+        """ call a function after a delay in seconds, without blocking the processing of the messages.
+        The delayed calls of an object run by a simulator host are scheduled by the host.
+        """
+        if delay <= 0:
+            function()
+        elif self.host is not None:
+            self.host.call_later(delay, function)
+        else:
+            timer = threading.Timer(delay, function)
+            timer.daemon = True
+            timer.start()
+
     def get_parameters_list(self):
         """ return the list of the configuration parameters """
-        return self.description["config"]["values"].keys()
+        return self.state.parameters.keys()
 
     def get_parameter_value(self, parameter_name):
         """ return the current value of a configuration parameter """
-        if parameter_name in self.description["config"]["values"].keys():
-            return self.description["config"]["values"][parameter_name]["value"]
-        else:
-            return "No such parameter"
+        return self.state.parameters.get(parameter_name, "No such parameter")
 
     def set_parameter_value(self, parameter_name, new_value):
         """ change the value of a configuration parameter """
-        self.description["config"]["values"][parameter_name]["value"] = new_value
+        self.set_parameter_values({parameter_name: new_value})
+
+    def set_parameter_values(self, new_values):
+        """ change the value of several configuration parameters with a single update in MongoDB """
+        update = {}
+        for parameter_name, new_value in new_values.items():
+            self.state.set_parameter(parameter_name, new_value)
+            update["config.values." + parameter_name + ".value"] = new_value
+        update["last_modified.value"] = str(datetime.utcnow())
         # Update MongoDB
-        self.mongo_client.cps2_project.objects.update_one(
-            {"_id": self.mongo_id},
-            {"$set": {"config.values." + parameter_name + ".value": new_value,
-                      "last_modified.value": str(datetime.utcnow())}
-            }
-        )
-        print("Switched the parameter " + parameter_name + " to " + new_value + " and updated MongoDB.")
+        self.mongo_writer.set(self.mongo_id, update)
+        logger.debug("Switched the parameters %s and updated MongoDB.", new_values)
+        if "publishing_mode" in new_values or "publishing_period" in new_values:
+            self.reschedule(0.0)
+
+    def apply_changes(self, config=None, fields=None):
+        """ apply a bulk change: the configuration parameters are changed together with a single write in MongoDB,
+        then the fields are changed. Unknown parameters and fields are ignored.
+        config and fields are dictionaries or None.
+        """
+        if config:
+            parameters = self.get_parameters_list()
+            new_values = {name: str(value) for name, value in config.items() if name in parameters}
+            if new_values:
+                self.set_parameter_values(new_values)
+        if fields:
+            for field_name, new_value in fields.items():
+                if field_name in self.get_fields_list():
+                    self.set_field_value(field_name, new_value)
 
     def get_fields_list(self):
         """ return the list of the available fields """
-        return self.description["fields"]["values"].keys()
+        return self.state.fields.keys()
 
     def get_field_value(self, field_name):
         """ return the current value of a field. """
-        if field_name in self.fields.keys():
-            # the value of the field is given either by a function or the system
-            if self.description["fields"]["values"][field_name]["source"] == "function":
-                return self.fields[field_name]()
-            elif self.description["fields"]["values"][field_name]["source"] == "system":
-                return self.fields[field_name]
-        else:
+        field = self.state.fields.get(field_name)
+        if field is None:
             return "No such field"
+        # the value of the field is given either by a function or the system
+        if field.function is None:
+            return field.value
+        return self.sample_field(field)
+
+    def sample_field(self, field):
+        """ call the function of a field, or return its last sample if it is younger than the ttl of the field """
+        if field.ttl:
+            now = monotonic()
+            if field.expires > now:
+                self.samples_saved += 1
+                return field.value
+            field.value = field.function()
+            field.expires = now + field.ttl
+        else:
+            field.value = field.function()
+        self.samples_taken += 1
+        return field.value
+
+    def sampling_stats(self):
+        """ return the number of calls to the functions of the fields, and the number of calls saved by their ttl """
+        return {"samples_taken": self.samples_taken, "samples_saved": self.samples_saved}
 
     def set_field_value(self, field_name, new_value):
         """ change the value of a field """
-        new_value = str(new_value)
-        self.fields[field_name] = new_value
+        field = self.state.fields[field_name]
+        field.value = str(new_value)
+        # The next request of a function field calls its function
+        field.expires = 0.0
         # Send the new value to InfluxDB
-        self.mqtt_client.publish(self.base_topic + "/metrics/" + field_name,
-                                             self.get_field_value(field_name))
-        print("Switched the field " + field_name + " to " + new_value + " and sent the new value to InfluxDB.")
+        timestamp = self.sample_timestamp()
+        self.publish_values({field_name: self.get_field_value(field_name)}, timestamp)
+        logger.debug("Switched the field %s to %s and sent the new value to InfluxDB.", field_name, new_value)
 
-    def add_field(self, field_name, label, description, type, function=None):
+    def add_field(self, field_name, label, description, type, function=None, ttl=None):
         """ add a field in the description of the object.
-         The value of the field is either given by a function, or updated by the system. """
+         The value of the field is either given by a function, or updated by the system.
+         With a ttl in seconds, the function is called at most once per ttl and its value is reused meanwhile. """
         new_field = {
             "label": label,
             "description": description,
             "type": type,
+            "source": "system" if function is None else "function"
         }
-        if function is not None:
-            new_field["source"] = "function"
-            self.fields[field_name] = function
-        else:
-            new_field["source"] = "system"
-            self.fields[field_name] = "No value"
-        self.description["fields"]["values"][field_name] = new_field
+        self.state.add_field(field_name, function, ttl)
 
         # update MongoDB
-        self.mongo_client.cps2_project.objects.update_one(
-            {"_id": self.mongo_id},
-            {"$set": {"fields.values." + field_name: new_field,
-                      "last_modified.value": str(datetime.utcnow())}
-             }
-        )
-        print("Added a new field called \"" + field_name + "\" and updated MongoDB.")
+        self.mongo_writer.set(self.mongo_id, {"fields.values." + field_name: new_field,
+                                              "last_modified.value": str(datetime.utcnow())})
+        logger.debug("Added a new field called \"%s\" and updated MongoDB.", field_name)
+
+    def flush(self):
+        """ write the pending updates of the object description in MongoDB now """
+        self.mongo_writer.flush()
+
+    def publish_fields(self):
+        """ publish the current value of all the fields """
+        timestamp = self.sample_timestamp()
+        self.publish_values({field_name: self.get_field_value(field_name) for field_name in self.state.fields},
+                            timestamp)
+
+    def sample_timestamp(self):
+        """ return the current time in nanoseconds since the epoch if the object timestamps its samples, None otherwise """
+        if self.state.object_timestamps:
+            return time_ns()
+        return None
+
+    def publish_values(self, values, timestamp=None):
+        """ publish the values of some fields, in one message per field or in a single message
+        depending on the publishing format. The timestamp of the sample is only sent in a single message.
+        """
+        publishing_format = self.state.publishing_format
+        if publishing_format == "batched":
+            if values:
+                self.mqtt_client.publish(self.state.batch_topic, encode_fields(values, timestamp))
+            return
+        if publishing_format == "binary":
+            if values:
+                self.mqtt_client.publish(self.state.binary_topic, encode_binary(values, timestamp))
+            return
+        fields = self.state.fields
+        for field_name, value in values.items():
+            self.mqtt_client.publish(fields[field_name].topic, value)
+
+    def publish_if_continuous(self):
+        """ publish the current value of all the fields if the object is in continuous mode """
+        if self.state.publishing_mode == "continuous":
+            self.publish_fields()
+
+    def schedule(self, scheduler):
+        """ publish the fields at each boundary of the publishing period with a scheduler (see scheduler.py) """
+        self.scheduler = scheduler
+        self.reschedule()
+
+    def reschedule(self, first_delay=None):
+        """ replace the publication job after a change of the publishing mode or period.
+        An object in on-demand mode has no job, so it is never woken up by the scheduler.
+        """
+        if self.scheduler is None:
+            return
+        if self.publish_job is not None:
+            self.scheduler.cancel(self.publish_job)
+            self.publish_job = None
+        if self.state.publishing_mode == "continuous":
+            self.publish_job = self.scheduler.every(lambda: self.state.publishing_period, self.publish_if_continuous,
+                                                    first_delay)
 
     def loop_forever(self):
         """ Publish and process MQTT messages forever """
-        while True:
-            if self.get_parameter_value("publishing_mode") == "continuous":
-                for field_name in self.get_fields_list():
-                    self.mqtt_client.publish(self.base_topic + "/metrics/" + field_name,
-                                             self.get_field_value(field_name))
-                sleep(float(self.get_parameter_value("publishing_period")) / 1000)
+        # The publications are fired at the period boundaries, the time spent publishing is not added to the period
+        scheduler = PublishScheduler()
+        self.schedule(scheduler)
+        scheduler.every(lambda: 60.0, lambda: logger.info("Field samples: %s", self.sampling_stats()),
+                        first_delay=60.0)
+        scheduler.run_forever()
 
 
 if __name__ == '__main__':
@@ -355,6 +552,8 @@ if __name__ == '__main__':
         print("Usage: " + __file__ + " <building> <floor> <room> <object_type> <object_name> "
                                      "<mongo_host> <mongo_port> <broker_url>")
 
+    setup_logging()
+
     ### Create the object
     dummy_object = DummyObject(building, floor, room, object_type, object_name, mongo_host, mongo_port, broker_url)
 
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+#
+# File: mongo_writer.py
+#
+# Description: write-coalescing layer between the objects and the collection "objects" in MongoDB.
+#
+# Features: the "$set" updates of an object are not sent to MongoDB immediately. They are merged per document
+# (a later value of a field replaces the previous one) and flushed by a background thread when no new update has
+# arrived for a short debounce window (or at the latest after max_delay). A burst of state changes, such as the
+# construction of an object, thus costs a single write per object. All the pending documents are flushed together
+# with one bulk_write. flush() writes the pending updates immediately, and they are also flushed when the program exits.
+#
+# Registration: the document of an object is upserted (register()) with the base topic of the object as its _id, so
+# restarting an object or a fleet updates the existing documents instead of inserting duplicates. The fields which
+# must not change after the creation (creation_date) are written with "$setOnInsert". The registration is coalesced
+# with the following updates of the object (add_field, ...), so creating an object costs a single write. Inside a
+# hold() block nothing is written in the background: a host registers thousands of objects and writes them all with one
+# bulk_write at the end of the block. ensure_object_indexes() creates the indexes of the collection (see
+# common/cps2_schema.py), among which the unique index on the location of the objects.
+#
+# Dependencies:
+#   - pymongo (sudo pip3 install pymongo)
+#
+####################################################################################################
+
+import atexit
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+# The shared modules are in the "common" directory at the root of the repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "common"))
+from cps2_schema import create_indexes
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY = 11000
+
+
+def ensure_object_indexes(collection):
+    """ create the indexes of the collection "objects" which do not exist yet """
+    try:
+        errors = create_indexes(collection.database, ["objects"])
+    except PyMongoError as e:
+        errors = [("objects", "all", e)]
+    for _, name, error in errors:
+        logger.warning("Unable to create the index %s of the objects "
+                       "(duplicate objects? see DB utils/empty_objects.py): %s", name, error)
+
+
+class CoalescingWriter:
+    """ merge the "$set" updates per document and write them in the background """
+
+    def __init__(self, collection, debounce=0.05, max_delay=1.0):
+        """ initialize the writer and start the flushing thread """
+        self.collection = collection
+        self.debounce = debounce
+        self.max_delay = max_delay
+
+        # document _id -> {dotted field path: value}
+        self.pending = {}
+        # document _id -> fields written only if the document is created, for the documents to upsert
+        self.upserts = {}
+        # number of hold() blocks in progress
+        self.held = 0
+        self.first_update = None
+        self.last_update = None
+        self.condition = threading.Condition()
+        # Only one flush at a time, to keep the updates of a document in order
+        self.flush_lock = threading.Lock()
+
+        self.updates_requested = 0
+        self.documents_written = 0
+        self.flushes = 0
+
+        self.thread = threading.Thread(target=self._run, name="mongo-coalescing-writer", daemon=True)
+        self.thread.start()
+        atexit.register(self.flush)
+
+    def set(self, document_id, fields):
+        """ schedule a "$set" of some fields of a document """
+        self._add(document_id, fields)
+
+    def register(self, document_id, document, on_insert=None):
+        """ schedule an upsert of a document. The fields of on_insert are only written if the document is created. """
+        self._add(document_id, document, on_insert or {})
+
+    @contextmanager
+    def hold(self):
+        """ keep the updates in memory until the end of the block, then write them all with one bulk_write """
+        with self.condition:
+            self.held += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.held -= 1
+                self.condition.notify()
+            self.flush()
+
+    def _add(self, document_id, fields, on_insert=None):
+        """ merge an update in the pending updates of a document """
+        with self.condition:
+            pending = self.pending.setdefault(document_id, {})
+            for path, value in fields.items():
+                merge(pending, path, value)
+            if on_insert is not None:
+                self.upserts.setdefault(document_id, {}).update(on_insert)
+            self.updates_requested += 1
+            now = time.monotonic()
+            if self.first_update is None:
+                self.first_update = now
+            self.last_update = now
+            self.condition.notify()
+
+    def flush(self):
+        """ write all the pending updates now """
+        with self.flush_lock:
+            with self.condition:
+                pending = self.pending
+                upserts = self.upserts
+                self.pending = {}
+                self.upserts = {}
+                self.first_update = None
+                self.last_update = None
+            if not pending:
+                return
+            document_ids = list(pending)
+            requests = [update_request(document_id, pending[document_id], upserts.get(document_id))
+                        for document_id in document_ids]
+            failed = {}
+            try:
+                self.collection.bulk_write(requests, ordered=False)
+            except BulkWriteError as e:
+                # The other documents are written
+                for error in e.details.get("writeErrors", []):
+                    document_id = document_ids[error["index"]]
+                    if error.get("code") == DUPLICATE_KEY:
+                        # Retrying would fail again
+                        logger.error("Object %s conflicts with a document of the same location "
+                                     "(see DB utils/empty_objects.py): %s", document_id, error.get("errmsg"))
+                    else:
+                        failed[document_id] = pending[document_id]
+                if failed:
+                    logger.error("Unable to update %d objects in MongoDB", len(failed))
+                    self._restore(failed, upserts)
+            except PyMongoError as e:
+                logger.error("Unable to update %d objects in MongoDB: %s", len(requests), e)
+                self._restore(pending, upserts)
+                return
+            with self.condition:
+                self.documents_written += len(requests) - len(failed)
+                self.flushes += 1
+
+    def stats(self):
+        """ return the counters of the writer """
+        with self.condition:
+            return {
+                "updates_requested": self.updates_requested,
+                "documents_written": self.documents_written,
+                "flushes": self.flushes,
+                "pending_documents": len(self.pending)
+            }
+
+    def _restore(self, failed, upserts):
+        """ put back the updates which could not be written, unless they have been overridden since """
+        with self.condition:
+            for document_id, fields in failed.items():
+                if document_id in upserts:
+                    on_insert = self.upserts.setdefault(document_id, {})
+                    for path, value in upserts[document_id].items():
+                        on_insert.setdefault(path, value)
+                pending = self.pending.setdefault(document_id, {})
+                for path, value in fields.items():
+                    if not any(conflict(path, other) for other in pending):
+                        pending[path] = value
+            # Retry after max_delay rather than immediately
+            self.first_update = self.last_update = time.monotonic() + self.max_delay
+
+    def _deadline(self):
+        """ time of the next flush. Must be called with the lock held. """
+        return min(self.last_update + self.debounce, self.first_update + self.max_delay)
+
+    def _run(self):
+        """ flushing thread: wait for the end of a burst of updates, then write them """
+        while True:
+            with self.condition:
+                while not self.pending or self.held or time.monotonic() < self._deadline():
+                    if not self.pending or self.held:
+                        self.condition.wait()
+                    else:
+                        self.condition.wait(max(0.0, self._deadline() - time.monotonic()))
+            self.flush()
+
+
+def update_request(document_id, fields, on_insert=None):
+    """ return the update of a document, an upsert if on_insert is not None """
+    if on_insert is None:
+        return UpdateOne({"_id": document_id}, {"$set": fields})
+    update = {"$set": fields}
+    if on_insert:
+        update["$setOnInsert"] = on_insert
+    return UpdateOne({"_id": document_id}, update, upsert=True)
+
+
+def conflict(path, other):
+    """ tell whether two dotted paths cannot be in the same "$set" (same field, or one contains the other) """
+    return path == other or path.startswith(other + ".") or other.startswith(path + ".")
+
+
+def merge(pending, path, value):
+    """ add a "$set" of path to the pending fields of a document, the new value replacing the previous ones """
+    for other in list(pending):
+        if other.startswith(path + "."):
+            # The new value replaces a sub-document which was updated before
+            del pending[other]
+        elif path.startswith(other + ".") and isinstance(pending[other], dict):
+            # Update the sub-document which is already pending
+            document = pending[other] = dict(pending[other])
+            keys = path[len(other) + 1:].split(".")
+            for key in keys[:-1]:
+                existing = document.get(key)
+                document[key] = dict(existing) if isinstance(existing, dict) else {}
+                document = document[key]
+            document[keys[-1]] = value
+            return
+    pending[path] = value
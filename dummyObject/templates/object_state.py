@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+#
+# File: object_state.py
+#
+# Description: flat runtime state of a dummy object, read by the hot paths (messages, requests, publications) instead
+# of the nested description document.
+#
+# Features: the description of an object (labels, types, possible values, ...) is only needed by MongoDB and the GUI.
+# The object keeps a compact state with __slots__ instead:
+#   - the topics it publishes and subscribes to, computed once,
+#   - its configuration parameters in a flat dictionary, and the values read on every message or publication
+#     (publishing mode, period and format, timestamp source, response latency) already converted,
+#   - one Field per field: its value or function, the cache of its samples and its metrics topic.
+# The changes are written both in the state and in MongoDB (see set_parameter_values and add_field in dummyObject.py),
+# so the state and the stored description stay in sync.
+#
+####################################################################################################
+
+from metrics_codec import PLACEHOLDER
+
+# Configuration parameters which are converted when they change
+DERIVED_PARAMETERS = ("publishing_mode", "publishing_period", "publishing_format", "timestamp_source",
+                      "response_latency")
+# publishing period in seconds until a valid one is set (the default value of the parameter)
+DEFAULT_PUBLISHING_PERIOD = 2.0
+
+
+def seconds(milliseconds, default):
+    """ convert a duration in milliseconds to seconds, or return the default if it is not a number """
+    try:
+        return float(milliseconds) / 1000
+    except (TypeError, ValueError):
+        return default
+
+
+class Field:
+    """ runtime state of a field: its value or its function, and the last sample of the function """
+    __slots__ = ("topic", "function", "ttl", "value", "expires")
+
+    def __init__(self, topic, function=None, ttl=None):
+        self.topic = topic
+        self.function = function
+        self.ttl = ttl
+        self.value = PLACEHOLDER if function is None else None
+        # monotonic time until which the last sample of the function is valid
+        self.expires = 0.0
+
+
+class ObjectState:
+    """ topics, configuration parameters and fields of an object """
+    __slots__ = ("location", "base_topic", "answer_prefix", "metrics_prefix", "batch_topic", "binary_topic",
+                 "subscription_topics", "parameters", "fields", "publishing_mode", "publishing_period",
+                 "publishing_format", "object_timestamps", "response_latency")
+
+    def __init__(self, location, parameters, batch_channel, binary_channel):
+        """ location is (building, floor, room, object_type, object_name), parameters is {name: value} """
+        self.location = tuple(location)
+        building, floor, room, type, name = self.location
+        self.base_topic = "/".join(self.location)
+        self.answer_prefix = self.base_topic + "/answer/"
+        self.metrics_prefix = self.base_topic + "/metrics/"
+        self.batch_topic = self.base_topic + "/" + batch_channel
+        self.binary_topic = self.base_topic + "/" + binary_channel
+        self.subscription_topics = (
+            building + "/" + floor + "/" + room + "/" + type + "/" + name + "/+",
+            building + "/" + floor + "/" + room + "/" + type + "/All/+",
+            building + "/" + floor + "/" + room + "/All/All/+",
+            building + "/" + floor + "/All/" + type + "/All/+",
+            building + "/" + floor + "/All/All/All/+",
+            building + "/All/All/" + type + "/All/+",
+            building + "/All/All/All/All/+",
+            "All/" + floor + "/All/All/All/+",
+            "All/All/All/" + type + "/All/+",
+            "All/All/All/All/" + name + "/+",
+            "All/All/All/All/All/+"
+        )
+
+        self.parameters = dict(parameters)
+        # field name -> Field, in the order in which the fields were added
+        self.fields = {}
+        self.publishing_period = DEFAULT_PUBLISHING_PERIOD
+        self.response_latency = 0.0
+        self.derive()
+
+    def set_parameter(self, name, value):
+        """ change the value of an existing configuration parameter """
+        if name not in self.parameters:
+            raise KeyError(name)
+        self.parameters[name] = value
+        if name in DERIVED_PARAMETERS:
+            self.derive()
+
+    def derive(self):
+        """ convert the parameters read on every message or publication. An invalid duration, or a publishing
+        period which is not positive, is ignored: the previous value is kept.
+        """
+        parameters = self.parameters
+        self.publishing_mode = parameters.get("publishing_mode")
+        period = seconds(parameters.get("publishing_period"), self.publishing_period)
+        if period > 0:
+            self.publishing_period = period
+        self.publishing_format = parameters.get("publishing_format")
+        self.object_timestamps = parameters.get("timestamp_source") == "object"
+        self.response_latency = seconds(parameters.get("response_latency"), self.response_latency)
+
+    def add_field(self, name, function=None, ttl=None):
+        """ add a field (or replace a field with the same name) and return it """
+        field = Field(self.metrics_prefix + name, function, ttl)
+        self.fields[name] = field
+        return field
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+#
+# File: routing.py
+#
+# Description: local routing of the "change" and "request" messages to the objects of a simulator host.
+#
+# Features: the topics of these messages are <building>/<floor>/<room>/<type>/<name>/<message_type>, where some
+# levels may be "All" to target a group of objects. Instead of subscribing to the 11 combinations of "All" accepted
+# by each object (11 broker subscriptions per object), the host subscribes once to all the "change" and "request"
+# messages (or once per building) and finds the targeted objects in a hash index: each subscription of an object is
+# stored under its 5 location levels, so a message costs one dictionary lookup and a walk over the matching objects,
+# whatever the number of objects in the host.
+#
+####################################################################################################
+
+# Types of the messages which are routed by the index
+ROUTED_MESSAGES = ("change", "request")
+
+
+class RoutingIndex:
+    """ find the objects targeted by a topic with a hash index over (building, floor, room, type, name) """
+
+    def __init__(self):
+        # (building, floor, room, type, name) -> {id(object): object}
+        self.table = {}
+
+    def add(self, topic_filter, obj):
+        """ index a subscription of an object and return its location levels,
+        or None if the filter is not of the form <building>/<floor>/<room>/<type>/<name>/+
+        """
+        levels = topic_filter.split("/")
+        if len(levels) != 6 or levels[5] != "+" or any(level in ("+", "#") for level in levels[:5]):
+            return None
+        key = tuple(levels[:5])
+        self.table.setdefault(key, {})[id(obj)] = obj
+        return key
+
+    def lookup(self, topic):
+        """ return the objects targeted by a routed topic (an empty list for the other topics) """
+        levels = topic.split("/")
+        if len(levels) != 6 or levels[5] not in ROUTED_MESSAGES:
+            return []
+        objects = self.table.get(tuple(levels[:5]))
+        return list(objects.values()) if objects else []
+
+    def __len__(self):
+        """ number of distinct location keys """
+        return len(self.table)
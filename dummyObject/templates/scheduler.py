@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+#
+# File: scheduler.py
+#
+# Description: scheduler shared by the objects to publish their fields periodically.
+#
+# Features: all the periodic jobs (the publication of the fields of each object) and the delayed calls (the answers
+# to the requests) are kept in one heap ordered by deadline, and fired by a single thread or asyncio task.
+#   - Drift correction: the next deadline of a periodic job is its previous deadline plus its period, not the time at
+#     which the job finished, so the time spent publishing is not added to the period. If a job is so late that it
+#     missed whole periods, they are skipped (and counted) rather than fired in a burst.
+#   - Jitter: with jitter > 0, the first deadline of each periodic job is shifted by a random fraction (up to jitter)
+#     of its period, so that objects created together do not all publish at the same instant.
+#   - Metrics: the lag between the deadline and the actual firing of the jobs (mean and max) and the number of missed
+#     periods are returned by stats() and logged every stats_interval seconds.
+#
+# The period of a job is a function which is called at each firing, so a new publishing period is taken into account
+# from the next deadline. A period shorter than MIN_PERIOD (e.g. 0 or negative) is raised to MIN_PERIOD, so a job
+# never fires in a loop and starves the other jobs. A job can also be cancelled (and replaced by a new one): cancel()
+# wakes up the scheduler, which then waits for the next remaining deadline. With no job due, the scheduler blocks on
+# its condition (or event) and costs no CPU.
+#
+####################################################################################################
+
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# shortest period of a periodic job, in seconds
+MIN_PERIOD = 0.01
+
+
+class Job:
+    """ a function called once after a delay, or at each boundary of a period """
+    __slots__ = ("function", "period", "deadline", "cancelled")
+
+    def __init__(self, function, period, deadline):
+        self.function = function
+        self.period = period
+        self.deadline = deadline
+        self.cancelled = False
+
+
+class PublishScheduler:
+    """ fire periodic and delayed jobs from a single heap """
+
+    def __init__(self, jitter=0.0, stats_interval=60.0, clock=time.monotonic):
+        """ initialize an empty scheduler. jitter is a fraction of the period, between 0 and 1. """
+        self.jitter = jitter
+        self.clock = clock
+
+        # heap of (deadline, sequence number, job)
+        self.heap = []
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        # called when a job is added, to wake up the asyncio task
+        self.wakeup = None
+
+        self.fired = 0
+        self.missed = 0
+        self.total_lag = 0.0
+        self.max_lag = 0.0
+
+        if stats_interval:
+            self.every(lambda: stats_interval, self.log_stats, first_delay=stats_interval)
+
+    def every(self, period, function, first_delay=None):
+        """ call a function at each boundary of a period and return the job.
+        period is a function returning the period in seconds.
+        """
+        if first_delay is None:
+            first_delay = random.uniform(0, self.jitter * period()) if self.jitter else 0.0
+        return self._push(Job(function, period, self.clock() + first_delay))
+
+    def call_later(self, delay, function):
+        """ call a function once after a delay in seconds and return the job """
+        return self._push(Job(function, None, self.clock() + delay))
+
+    def cancel(self, job):
+        """ stop firing a job. It is removed from the heap when its deadline is reached. """
+        with self.condition:
+            job.cancelled = True
+            self.condition.notify()
+        if self.wakeup is not None:
+            self.wakeup()
+
+    def run_pending(self):
+        """ fire the jobs which are due and return the delay until the next deadline (None if there is no job) """
+        while True:
+            with self.condition:
+                if not self.heap:
+                    return None
+                now = self.clock()
+                deadline, _, job = self.heap[0]
+                if job.cancelled:
+                    heapq.heappop(self.heap)
+                    continue
+                if deadline > now:
+                    return deadline - now
+                heapq.heappop(self.heap)
+
+            lag = now - deadline
+            try:
+                job.function()
+            except Exception as e:
+                logger.error("Error in a scheduled job: %s", e)
+
+            with self.condition:
+                self.fired += 1
+                self.total_lag += lag
+                self.max_lag = max(self.max_lag, lag)
+                if job.period is not None and not job.cancelled:
+                    period = max(job.period(), MIN_PERIOD)
+                    # Next boundary after now, skipping the periods which were missed entirely
+                    periods = int(lag // period) + 1
+                    self.missed += periods - 1
+                    job.deadline = deadline + periods * period
+                    heapq.heappush(self.heap, (job.deadline, next(self.sequence), job))
+
+    def run_forever(self):
+        """ fire the jobs forever in the calling thread """
+        while True:
+            delay = self.run_pending()
+            with self.condition:
+                # A job added meanwhile may be due before the delay
+                if not self.heap or self.heap[0][0] > self.clock():
+                    self.condition.wait(delay)
+
+    async def run_async(self):
+        """ fire the jobs forever in an asyncio task """
+        loop = asyncio.get_event_loop()
+        event = asyncio.Event()
+        self.wakeup = lambda: loop.call_soon_threadsafe(event.set)
+        while True:
+            delay = self.run_pending()
+            try:
+                await asyncio.wait_for(event.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+            event.clear()
+
+    def stats(self):
+        """ return the counters of the scheduler """
+        with self.condition:
+            return {
+                "jobs": len(self.heap),
+                "fired": self.fired,
+                "missed_periods": self.missed,
+                "mean_lag_ms": self.total_lag / self.fired * 1000 if self.fired else 0.0,
+                "max_lag_ms": self.max_lag * 1000
+            }
+
+    def log_stats(self):
+        """ log the scheduling lag and reset the maximum """
+        stats = self.stats()
+        logger.info("Scheduler: %d jobs, %d fired, mean lag %.2f ms, max lag %.2f ms, %d missed periods",
+                    stats["jobs"], stats["fired"], stats["mean_lag_ms"], stats["max_lag_ms"], stats["missed_periods"])
+        with self.condition:
+            self.max_lag = 0.0
+
+    def _push(self, job):
+        """ add a job to the heap and wake up the scheduler """
+        with self.condition:
+            heapq.heappush(self.heap, (job.deadline, next(self.sequence), job))
+            self.condition.notify()
+        if self.wakeup is not None:
+            self.wakeup()
+        return job
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+#
+# File: simulator_host.py
+#
+# Description: run a whole fleet of dummy objects in a single process, for load testing.
+#
+# Features: all the objects share one MQTT connection, one MongoDB client (and thus its connection pool) and one
+# write-coalescing layer. The messages received on the shared connection are dispatched to the objects whose
+# subscription topics match, found through a local routing index (see routing.py). A single scheduler (see
+# scheduler.py) publishes the fields of the objects in continuous mode, each one at the boundaries of its own
+# publishing period, and fires the delayed answers to the requests.
+# The routing of the "change" and "request" messages is chosen with --routing:
+#   - "single" (default): the host subscribes once to +/+/+/+/+/change and +/+/+/+/+/request, and finds the targeted
+#     objects in the routing index,
+#   - "building": same, with one subscription per building (and one for "All"), so the host only receives the
+#     messages of the buildings of its objects,
+#   - "broker": the host subscribes to the 11 topic filters of each object (previous behaviour).
+# In the routed modes, the objects receive the "change" and "request" messages only.
+#
+# The objects are registered in MongoDB with upserts keyed by their base topic, written together with one bulk_write
+# once the whole fleet is created, so restarting the host does not duplicate the objects. The creation and
+# registration time per 1000 objects is logged.
+#
+# With --jitter, the first publication of each object is shifted by a random fraction of its period so that the
+# objects do not all publish at the same instant.
+#
+# The fleet is described in a JSON file (see fleet_example.json):
+# {
+#   "mongodb_host": "localhost", "mongodb_port": 27017, "broker_url": "localhost",
+#   "objects": [
+#     {"class": "lamp.Lamp", "count": 100, "building": "EF", "floor": "1", "room": "1.{i}",
+#      "object_type": "Lamp", "object_name": "Lamp {i}"}
+#   ]
+# }
+# Each group creates "count" objects of the class "<module>.<class>"; "{i}" is replaced by the index of the object
+# in the group in all the location fields. The addresses of MongoDB and of the broker are optional: they default to
+# the shared settings (see common/cps2_config.py), which also set the pool size, timeouts and keep-alive of the clients.
+#
+# Usage: python3 simulator_host.py <fleet.json> [--jitter <fraction of the period>] [--routing single|building|broker]
+#
+# Note: the objects are driven by the scheduler of the host, so a loop_forever overridden in a child class is not run.
+#
+# Dependencies:
+#   - paho-mqtt (sudo pip3 install paho-mqtt)
+#   - pymongo (sudo pip3 install pymongo)
+#
+####################################################################################################
+
+import argparse
+import importlib
+import json
+import logging
+import threading
+import time
+
+from paho.mqtt.client import topic_matches_sub
+
+from dummyObject import setup_logging
+# dummyObject adds the "common" directory to the module search path
+from cps2_config import get_config, mongo_client, mqtt_client, mqtt_connect
+from mongo_writer import CoalescingWriter, ensure_object_indexes
+from routing import ROUTED_MESSAGES, RoutingIndex
+from scheduler import PublishScheduler
+
+logger = logging.getLogger("simulator_host")
+
+LOCATION_FIELDS = ("building", "floor", "room", "object_type", "object_name")
+ROUTING_MODES = ("single", "building", "broker")
+
+
+class SimulatorHost:
+    """ share the connections and the scheduling of many objects in one process """
+
+    def __init__(self, mongodb_host, mongodb_port, broker_url, jitter=0.0, routing="single"):
+        """ connect to MongoDB and to the MQTT broker """
+        if routing not in ROUTING_MODES:
+            raise ValueError("Unknown routing mode: " + routing)
+        self.routing = routing
+        logger.info("Connecting to MongoDB.")
+        self.mongo_client = mongo_client(mongodb_host, mongodb_port)
+        ensure_object_indexes(self.mongo_client.cps2_project.objects)
+        self.mongo_writer = CoalescingWriter(self.mongo_client.cps2_project.objects)
+
+        self.objects = []
+        # topic filter -> objects which subscribed to it (the filters which are not in the routing index)
+        self.subscriptions = {}
+        # subscriptions of the host to the routed messages
+        self.routing_index = RoutingIndex()
+        self.routed_topics = set()
+        self.lock = threading.Lock()
+        self.scheduler = PublishScheduler(jitter)
+        self.scheduler.every(lambda: 60.0, self.log_stats, first_delay=60.0)
+
+        self.mqtt_client = mqtt_client()
+        self.mqtt_client.on_message = self.on_message
+        self.mqtt_client.on_connect = self.on_connect
+        logger.info("Connecting to the MQTT broker %s.", broker_url or get_config("mqtt")["host"])
+        self.connect(broker_url)
+
+    def connect(self, broker_url):
+        """ connect the shared MQTT client and start its network loop """
+        mqtt_connect(self.mqtt_client, broker_url)
+        self.mqtt_client.loop_start()
+
+    def subscribe(self, topic):
+        """ subscribe the shared MQTT client to a topic """
+        self.mqtt_client.subscribe(topic)
+
+    def call_later(self, delay, function):
+        """ call a function after a delay in seconds (used by the objects to simulate their response latency) """
+        self.scheduler.call_later(delay, function)
+
+    def register(self, obj):
+        """ add an object to the host. Called by the object when it is created with this host. """
+        with self.lock:
+            self.objects.append(obj)
+            obj.schedule(self.scheduler)
+            for topic in obj.get_subscription_topics():
+                if self.routing != "broker":
+                    key = self.routing_index.add(topic, obj)
+                    if key is not None:
+                        self.subscribe_routed("+" if self.routing == "single" else key[0])
+                        continue
+                if topic not in self.subscriptions:
+                    self.subscriptions[topic] = []
+                    self.subscribe(topic)
+                self.subscriptions[topic].append(obj)
+
+    def subscribe_routed(self, building):
+        """ subscribe to the routed messages of a building ("+" for all of them), if not done yet """
+        for message_type in ROUTED_MESSAGES:
+            topic = building + "/+/+/+/+/" + message_type
+            if topic not in self.routed_topics:
+                self.routed_topics.add(topic)
+                self.subscribe(topic)
+
+    def count_subscriptions(self):
+        """ return the number of subscriptions of the host to the broker """
+        with self.lock:
+            return len(self.subscriptions) + len(self.routed_topics)
+
+    def on_connect(self, client, userdata, flags, rc):
+        """ subscribe again to all the topics after a reconnection """
+        with self.lock:
+            topics = list(self.routed_topics) + list(self.subscriptions)
+        for topic in topics:
+            self.subscribe(topic)
+
+    def on_message(self, client, userdata, msg):
+        """ dispatch a message to the objects which subscribed to its topic """
+        with self.lock:
+            routed = self.routing_index.lookup(msg.topic)
+            subscriptions = list(self.subscriptions.items())
+        # An object receives a message once, even if several of its subscriptions match
+        recipients = {id(obj): obj for obj in routed}
+        for topic_filter, objects in subscriptions:
+            if topic_matches_sub(topic_filter, msg.topic):
+                for obj in objects:
+                    recipients[id(obj)] = obj
+        for obj in recipients.values():
+            try:
+                obj.on_message(msg.topic, msg.payload)
+            except Exception as e:
+                logger.error("Error while processing a message on %s for %s: %s", msg.topic, obj.base_topic, e)
+
+    def log_stats(self):
+        """ log the number of calls to the functions of the fields, and the number of calls saved by their ttl """
+        with self.lock:
+            objects = list(self.objects)
+        taken = saved = 0
+        for obj in objects:
+            stats = obj.sampling_stats()
+            taken += stats["samples_taken"]
+            saved += stats["samples_saved"]
+        logger.info("%d objects: %d field samples taken, %d saved by the cache", len(objects), taken, saved)
+
+    def loop_forever(self):
+        """ publish the fields of the objects in continuous mode forever """
+        self.scheduler.run_forever()
+
+
+def load_class(path):
+    """ return the class "<module>.<class>" """
+    module_name, class_name = path.rsplit(".", 1)
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def create_fleet(host, fleet):
+    """ create all the objects of a fleet description in the host, and register them in MongoDB with one bulk_write """
+    start = time.monotonic()
+    count = 0
+    with host.mongo_writer.hold():
+        for group in fleet["objects"]:
+            object_class = load_class(group["class"])
+            for i in range(group.get("count", 1)):
+                location = [str(group[field]).replace("{i}", str(i)) for field in LOCATION_FIELDS]
+                object_class(*location, fleet.get("mongodb_host"), fleet.get("mongodb_port"), fleet.get("broker_url"),
+                             host=host)
+                count += 1
+        created = time.monotonic()
+    registered = time.monotonic()
+    if count:
+        logger.info("%d objects created in %.2f s and registered in MongoDB in %.2f s (%.3f s per 1000 objects)",
+                    count, created - start, registered - created, (registered - start) / count * 1000)
+
+
+def parse_arguments():
+    """ return the command line arguments of a simulator host """
+    parser = argparse.ArgumentParser(description="Run a fleet of dummy objects in a single process.")
+    parser.add_argument("fleet", help="JSON description of the fleet")
+    parser.add_argument("--routing", choices=ROUTING_MODES, default="single",
+                        help="single: one subscription for all the objects and local routing (default), "
+                             "building: one subscription per building and local routing, "
+                             "broker: the 11 subscriptions of each object")
+    parser.add_argument("--jitter", type=float, default=1.0,
+                        help="random shift of the first publication of each object, as a fraction of its period "
+                             "(default: 1.0, 0 to publish all the objects together)")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+
+    setup_logging()
+    with open(args.fleet) as fleet_file:
+        fleet = json.load(fleet_file)
+
+    host = SimulatorHost(fleet.get("mongodb_host"), fleet.get("mongodb_port"), fleet.get("broker_url"), args.jitter,
+                         args.routing)
+    start = time.monotonic()
+    create_fleet(host, fleet)
+    logger.info("%d objects created in %.1f s, %d subscriptions to the broker", len(host.objects),
+                time.monotonic() - start, host.count_subscriptions())
+
+    try:
+        # Publish the fields of the objects forever
+        host.loop_forever()
+    except KeyboardInterrupt:
+        host.mongo_writer.flush()
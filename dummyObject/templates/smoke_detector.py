@@ -11,15 +11,17 @@
 import sys
 from time import time
 
-from dummyObject import DummyObject
+from dummyObject import DummyObject, setup_logging
 
 
 class SmokeDetector(DummyObject):
     """ A smoke detector with a status """
 
-    def __init__(self, building, floor, room, object_type, object_name, mongodb_host, mongodb_port, broker_url):
+    def __init__(self, building, floor, room, object_type, object_name, mongodb_host, mongodb_port, broker_url,
+                 **kwargs):
         """ initialize the object """
-        super().__init__(building, floor, room, object_type, object_name, mongodb_host, mongodb_port, broker_url)
+        super().__init__(building, floor, room, object_type, object_name, mongodb_host, mongodb_port, broker_url,
+                         **kwargs)
 
         # add the fields that define what the object can measure
         self.add_field(
@@ -74,6 +76,8 @@ if __name__ == '__main__':
         print("Usage: " + __file__ + " <building> <floor> <room> <object_type> <object_name> "
                                      "<mongo_host> <mongo_port> <broker_url>")
 
+    setup_logging()
+
     # Create the object
     smoke = SmokeDetector(building, floor, room, object_type, object_name, mongo_host, mongo_port, broker_url)
     start = time()
@@ -4,7 +4,8 @@
 #
 # Description: a simple object that inherits the DummyObject class which is the top level.
 #
-# Features: published some metrics from the system it is running on
+# Features: published some metrics from the system it is running on. The metrics are sampled at most once per second
+# (every 10 seconds for the disk usage), whatever the number of requests and the publishing period.
 #
 # Dependencies:
 # 	- psutil (sudo pip3 install psutil)
@@ -14,15 +15,17 @@
 import psutil
 import sys
 
-from dummyObject import DummyObject
+from dummyObject import DummyObject, setup_logging
 
 
 class SystemDataPublisher(DummyObject):
     """ Simple object that publishes some metrics from the system it is running on """
 
-    def __init__(self, building, floor, room, object_type, object_name, mongodb_host, mongodb_port, broker_url):
+    def __init__(self, building, floor, room, object_type, object_name, mongodb_host, mongodb_port, broker_url,
+                 **kwargs):
         """ initialize the object """
-        super().__init__(building, floor, room, object_type, object_name, mongodb_host, mongodb_port, broker_url)
+        super().__init__(building, floor, room, object_type, object_name, mongodb_host, mongodb_port, broker_url,
+                         **kwargs)
 
         # add the fields that define what the object can measure
         self.add_field(
@@ -30,21 +33,24 @@ class SystemDataPublisher(DummyObject):
             label="Disk usage",
             description="The disk usage in percent",
             type="Float",
-            function=lambda: psutil.disk_usage('/').percent
+            function=lambda: psutil.disk_usage('/').percent,
+            ttl=10.0
         )
         self.add_field(
             field_name="memory_usage",
             label="Memory usage",
             description="The RAM usage in percent",
             type="Float",
-            function=lambda: psutil.virtual_memory().percent
+            function=lambda: psutil.virtual_memory().percent,
+            ttl=1.0
         )
         self.add_field(
             field_name="cpu_usage",
             label="CPU usage",
             description="The CPU usage in percent",
             type="Float",
-            function=lambda: psutil.cpu_percent(interval=None)
+            function=lambda: psutil.cpu_percent(interval=None),
+            ttl=1.0
         )
 
     def custom_mqtt_reaction(self, topic, message):
@@ -79,6 +85,8 @@ if __name__ == '__main__':
         print("Usage: " + __file__ + " <building> <floor> <room> <object_type> <object_name> "
                                      "<mongo_host> <mongo_port> <broker_url>")
 
+    setup_logging()
+
     # Create the object
     my_publisher = SystemDataPublisher(building, floor, room, object_type, object_name, mongo_host, mongo_port, broker_url)
 
@@ -9,6 +9,11 @@
 # - Add scenarios in MongoDB
 # - Launch InfluxDB and MongoDB subscribers
 # - Launch several object instances in terminals
+#
+# The connection settings are in common/cps2_config.py: by default MongoDB and the MQTT broker are at 192.168.43.48
+# (the InfluxDB subscriber connects to the broker on localhost) and InfluxDB is on localhost. Export CPS2_MONGODB_HOST,
+# CPS2_MQTT_HOST or CPS2_INFLUXDB_HOST (or give a JSON file in CPS2_CONFIG) to run the demo elsewhere, e.g.
+#   CPS2_MONGODB_HOST=localhost CPS2_MQTT_HOST=localhost ./run_demo.sh
 
 sudo service mongod start
 